@@ -7,48 +7,66 @@ import dash_html_components as html
 import dash_core_components as dcc
 import dash_bootstrap_components as dbc
 from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
 from flask_caching import Cache
+from pymongo.errors import OperationFailure
 
 
-import datetime, os
+import datetime, os, time
 
-import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
 
 from models import *
+import stats
+from journal_search import JournalSearchIndex
 
 # Config
 STATIC_PLOT = True
 SHOW_SCATTER = False
 CACHE_TIMEOUT = 24 * 60 * 60 #seconds
+LAYOUT_CACHE_TIMEOUT = 60 * 60 #seconds, journals list and database stats are also invalidated by the updater
 LIST_ALL_JOURNALS = False # list all journals vs only those with articles in the database
+SERVER_SIDE_AGGREGATION = False # experimental: summarize filtered views of journals too large for REVIEW_DATES_CACHE_SIZE in the database (requires MongoDB >= 7.0, see tests/test_aggregation.py)
+REVIEW_DATES_CACHE_SIZE = 64 * 1024 * 1024 # bytes, per worker
+JOURNAL_STATS_CACHE_SIZE = 1024 # journals, per worker
+MEMORY_CACHE_MAX_AGE = 60 * 60 #seconds, review dates and journal stats in memory are also invalidated by the updater
 
 
-# Get available journals list
+# Get available journals list and build their search index
 if LIST_ALL_JOURNALS:
-    journals_list = sorted(Journal.objects.only('abbr_name').values_list('abbr_name'))
+    journal_search_index = JournalSearchIndex(Journal.objects.only('abbr_name', 'full_name', 'issns').exclude('id').as_pymongo())
+    journals_list = sorted(journal_search_index.abbr_names)
 # otherwise get the list of journals from the database inside serve_layout()
+else:
+    journal_search_index = None
+journal_search_index_time = None
 
 # App initialization and layout
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
 app.title = 'Review Speed Analytics'
 server = app.server
+#> Two levels of caching: the rendered cards and graphs are memoized in the cache 
+#  shared by the workers, and the review dates and statistics of recently viewed 
+#  journals are kept in the memory of each worker, so that changing the plot metric 
+#  or date range does not query the database
 cache = Cache(server, config={
     'CACHE_TYPE': 'FileSystemCache',
     'CACHE_DIR': 'FlaskCaching'
 })
+review_dates_cache = stats.ReviewDatesCache(REVIEW_DATES_CACHE_SIZE, MEMORY_CACHE_MAX_AGE)
+journal_stats_cache = stats.JournalStatsCache(JOURNAL_STATS_CACHE_SIZE, MEMORY_CACHE_MAX_AGE)
 
 
 
-def create_summary_cards(articles_df):
+def create_summary_cards(summary):
     """
     Creates html summary cards for Submit to Accept, Accept to Publish,
-    and Submit to Publish duration based on articles_df
+    and Submit to Publish duration based on summary
 
     Parameters
     ----------
-    artilces_df: (pandas.DataFrame) The review speed data from selected articles
+    summary: (dict) The review speed statistics of selected articles (see stats.summarize_review_intervals)
 
     Returns
     ----------
@@ -60,8 +78,8 @@ def create_summary_cards(articles_df):
     cards = [
         dbc.Card(
             [
-                html.H2(f"{articles_df.shape[0]} Articles", className="card-title"),
-                html.H5(f"{articles_df['published'].min().strftime('%Y %b')} - {articles_df['published'].max().strftime('%Y %b')}", className="card-title"),
+                html.H2(f"{summary['n_articles']} Articles", className="card-title"),
+                html.H5(f"{summary['first_published'].strftime('%Y %b')} - {summary['last_published'].strftime('%Y %b')}", className="card-title"),
                 html.Br(className="card-text"),
             ],
             body=True,
@@ -70,10 +88,11 @@ def create_summary_cards(articles_df):
     ]
     #> Review speed median(IQR) cards
     for idx, var in enumerate(['Submit to Accept', 'Accept to Publish', 'Submit to Publish']):
+        interval_stats = summary['intervals'][var]
         card = dbc.Card(
             [
-                html.H2(f"{articles_df[var].median()}", className="card-title"),
-                html.H5(f"({articles_df[var].quantile(.25)}-{articles_df[var].quantile(.75)})", className="card-title"),
+                html.H2(f"{interval_stats['median']}", className="card-title"),
+                html.H5(f"({interval_stats['q1']}-{interval_stats['q3']})", className="card-title"),
                 html.P(var, className="card-text"),
             ],
             body=True,
@@ -82,26 +101,31 @@ def create_summary_cards(articles_df):
         cards.append(card)
     return cards
 
-def plot_histogram(articles_df, plot_metric='Submit to Accept'):
+def plot_histogram(summary, plot_metric='Submit to Accept'):
     """
-    Plots the histogram for Submit to Accept duration based on articles_df
+    Plots the histogram for Submit to Accept duration based on summary
 
     Parameters
     ----------
-    artilces_df: (pandas.DataFrame) The review speed data from selected articles
+    summary: (dict) The review speed statistics of selected articles (see stats.summarize_review_intervals)
     plot_metric: (str) "Submit to Accept" (default), "Accept to Publish" and "Submit to Publish"
 
     Returns
     ----------
     graph: (dcc.Graph) review speed histogram
     """
-    nbins = int((articles_df[plot_metric].max() - articles_df[plot_metric].min()) // 10)
-    fig = px.histogram(articles_df, 
-                       x=plot_metric, 
-                       nbins=nbins)
+    histogram = summary['histograms'][plot_metric]
+    bin_size = stats.HISTOGRAM_BIN_SIZE
+    fig = go.Figure(go.Bar(
+        x=[bin_left + bin_size / 2 for bin_left in histogram['bins']],
+        y=histogram['counts'],
+        width=bin_size,
+        hovertext=[f"{bin_left}-{bin_left + bin_size - 1}" for bin_left in histogram['bins']],
+    ))
     fig.update_layout(
         xaxis_title=f"{plot_metric} (days)",
         yaxis_title="Count",
+        bargap=0,
     )
     graph = dcc.Graph(
                     id='histogram',
@@ -112,29 +136,36 @@ def plot_histogram(articles_df, plot_metric='Submit to Accept'):
     return graph
 
 # Trend plot
-def plot_trend(articles_df, plot_metric='Submit to Accept'):
+def plot_trend(summary, plot_metric='Submit to Accept', scatter_df=None):
     """
-    Plots the monthly trend of Submit to Accept duration based on articles_df
+    Plots the monthly trend of Submit to Accept duration based on summary
     
     Parameters
     ----------
-    artilces_df: (pandas.DataFrame) The review speed data from selected articles
+    summary: (dict) The review speed statistics of selected articles (see stats.summarize_review_intervals)
     plot_metric: (str) "Submit to Accept" (default), "Accept to Publish" and "Submit to Publish"
+    scatter_df: (pandas.DataFrame or None) The review speed data of individual articles,
+        shown if SHOW_SCATTER
 
     Returns
     ----------
     graph: (dcc.Graph) Submit to Accept monthly trend plot
     """
-    DOI_BASE = 'https://doi.org/'
-    articles_grouped_by_month = articles_df.set_index('published').groupby(pd.Grouper(freq='MS'))
-    monthly_trend_median = articles_grouped_by_month[plot_metric].median()
+    monthly = summary['monthly'][plot_metric]
+    #> Include the months without articles in the trend line as gaps
+    monthly_trend_median = (
+        pd.Series(monthly['median'], index=pd.DatetimeIndex(monthly['months']))
+        .reindex(pd.date_range(monthly['months'][0], monthly['months'][-1], freq='MS')))
     #> Initialize the figure
     fig = go.Figure()
     #> Add boxplots for each month
     fig.add_trace(go.Box(
-        y=articles_df[plot_metric],
-        x=articles_df['published'].apply(lambda x: datetime.datetime(x.year, x.month, 1)),
-        # .to_period is not an option because plotly doesn't work with pd.Period
+        x=monthly['months'],
+        q1=monthly['q1'],
+        median=monthly['median'],
+        q3=monthly['q3'],
+        lowerfence=monthly['lowerfence'],
+        upperfence=monthly['upperfence'],
         boxpoints=False,
         name='Monthly Boxplot',
         showlegend=SHOW_SCATTER, #show the legend only if scatter is also shown
@@ -151,13 +182,13 @@ def plot_trend(articles_df, plot_metric='Submit to Accept'):
         hoverinfo='none'
     ))
     #> Add the review speed of individual studies scatter
-    if SHOW_SCATTER:
+    if SHOW_SCATTER and (scatter_df is not None):
         fig.add_trace(go.Scatter(
-            y=articles_df[plot_metric],
-            x=articles_df['published'], 
+            y=scatter_df[plot_metric],
+            x=scatter_df['published'], 
             mode='markers',
             name='Articles',
-            text=articles_df['doi'],
+            text=scatter_df['doi'],
             showlegend=True
         ))
     fig.update_layout(
@@ -177,24 +208,83 @@ def plot_trend(articles_df, plot_metric='Submit to Accept'):
         )
     return graph
 
+def create_journal_option(journal):
+    """
+    Creates the dropdown option of a journal, which can also be found 
+    by its full name and ISSNs
+
+    Parameters
+    ----------
+    journal: (dict) with abbr_name, full_name and issns
+
+    Returns
+    ----------
+    option: (dict)
+    """
+    return {
+        'label': journal['abbr_name'],
+        'value': journal['abbr_name'],
+        'title': journal.get('full_name'),
+        'search': ' '.join([journal['abbr_name'], journal.get('full_name') or ''] + (journal.get('issns') or [])),
+    }
+
+def get_layout_data():
+    """
+    Gets the list of journals with articles and the total number of articles,
+    shared by all workers through the cache. The cached data is reused until
+    LAYOUT_CACHE_TIMEOUT or until the updater marks the database as updated,
+    so that warm page loads only read the database version, at most every
+    stats.DATABASE_VERSION_CHECK_INTERVAL seconds
+
+    Returns
+    ----------
+    layout_data: (dict) with 'journals' (list of dict with abbr_name, full_name and issns,
+        empty if LIST_ALL_JOURNALS), 'n_articles', 'database_version' of the data and 'cached_time'
+    """
+    database_version = stats.get_database_version()
+    layout_data = cache.get('layout_data')
+    if (layout_data is not None) and (layout_data['database_version'] == database_version):
+        return layout_data
+    if LIST_ALL_JOURNALS:
+        #> All journals are already in journal_search_index
+        journals = []
+    else:
+        #> Get the ids of journals with articles and then their names, without dereferencing the journals
+        journal_ids = Article._get_collection().distinct('journal')
+        journals = Journal.objects(id__in=journal_ids).only('abbr_name', 'full_name', 'issns').exclude('id').as_pymongo()
+    layout_data = {
+        'journals': sorted(journals, key=lambda journal: journal['abbr_name']),
+        'n_articles': Article._get_collection().estimated_document_count(),
+        'database_version': database_version,
+        'cached_time': time.time(),
+    }
+    cache.set('layout_data', layout_data, timeout=LAYOUT_CACHE_TIMEOUT)
+    return layout_data
+
 #> App base layout
 def serve_layout():
     # on every reload, get available journals list
     # if not LIST_ALL_JOURNALS
     # the journal list update is put here to enforce
-    # running it on every reload
-    global journals_list, journal_options
+    # running it on every reload (it is cached in get_layout_data)
+    global journals_list, journal_options, journal_search_index, journal_search_index_time
+    layout_data = get_layout_data()
     if not LIST_ALL_JOURNALS:
-        # Get available journals list
-        journals_list = sorted([journal.abbr_name for journal in Article.objects.distinct('journal')])
-    journal_options = []
-    for abbr_name in journals_list:
-        journal_options.append({'label': abbr_name, 'value': abbr_name})
+        # Get available journals list and rebuild the search index if it has changed
+        journals_list = [journal['abbr_name'] for journal in layout_data['journals']]
+        if journal_search_index_time != layout_data['cached_time']:
+            #> The index is not rebuilt when only the articles of listed journals have changed
+            if (journal_search_index is None) or (journal_search_index.abbr_names != journals_list):
+                journal_search_index = JournalSearchIndex(layout_data['journals'])
+            journal_search_index_time = layout_data['cached_time']
+        journal_options = [create_journal_option(journal) for journal in layout_data['journals']]
+    else:
+        journal_options = []
     # Construct the layout
     # top panel: define the journal and date selection forms
     ## journal list is shown in dropdown if only available journals are listed
     ## otherwise, the journals are shown only in response to search
-    stats_str = f'Total number of articles in the database: {Article.objects.count()}'
+    stats_str = f"Total number of articles in the database: {layout_data['n_articles']}"
     if not LIST_ALL_JOURNALS:
         journals_dropdown = dcc.Dropdown(id="journal-abbr-dropdown", options=journal_options)
         stats_str += f' (from {len(journals_list)} journals)'
@@ -275,11 +365,15 @@ app.layout = serve_layout
 )
 def update_options(search_value):
     """
-    Callback handling journal name search autocomplete
+    Callback handling journal name search autocomplete, using the search
+    index of journal abbreviations, full names and ISSNs
     """
     if not search_value:
+        if LIST_ALL_JOURNALS:
+            #> Keep the current options (including the selected journal)
+            raise PreventUpdate
         return journal_options
-    return [o for o in journal_options if search_value.lower() in o["label"].lower()]
+    return [create_journal_option(journal) for journal in journal_search_index.search(search_value)]
 
 # > Journal info view callback
 @app.callback(
@@ -312,41 +406,56 @@ def show_journal_info(journal_abbr, plot_metric, start_date, end_date):
     numbers_note_style: (dict) indicating whether the note about median(IQR) should be visible
     plot_metric_formgroup_style: (dict) indicating whether the note about median(IQR) should be visible
     """
+    global SERVER_SIDE_AGGREGATION
     if journal_abbr:
-        #> Get articles df for the journal from db
-        journal = Journal.objects.get(abbr_name=journal_abbr)
-        articles = Article.objects.filter(journal=journal).only('received', 'accepted', 'published')
-        if articles.count() == 0:
-            return [html.H4("No data available")], [], {'display': 'none'}, {'display': 'none'}
-        articles_df = pd.DataFrame([article.to_mongo().to_dict() for article in articles])
-        articles_df['journal']=journal.abbr_name
-        missing_events = []
-        for event in ['received', 'accepted', 'published']:
-            if event in articles_df.columns:
-                articles_df[event] = pd.to_datetime(articles_df[event])
-            else:
-                missing_events.append(event)
-        if missing_events:
-            missing_events_str = f"{' and '.join([event.title() for event in missing_events])} dates not reported"
-            return [html.H4(missing_events_str)], [], {'display': 'none'}, {'display': 'none'}
-        #> Limit to start_date and end_date
-        if start_date:
-            articles_df = articles_df[articles_df['published'] >= start_date]
-        if end_date:
-            articles_df = articles_df[articles_df['published'] <= end_date]
-        #> Drop NA dates (TODO: deal with NA values in a better way)
-        articles_df = articles_df.loc[articles_df[['received', 'accepted', 'published']].dropna().index]
-        #> Calculate intervals
-        articles_df['Submit to Accept'] = (articles_df['accepted'] - articles_df['received']).dt.days
-        articles_df['Accept to Publish'] = (articles_df['published'] - articles_df['accepted']).dt.days
-        articles_df['Submit to Publish'] = (articles_df['published'] - articles_df['received']).dt.days
+        summary = None
+        #> Get the review dates of the journal from memory, and load them when 
+        #  the articles are filtered by date
+        review_dates = review_dates_cache.get(journal_abbr, load=bool(start_date or end_date))
+        if (review_dates is None) and not (start_date or end_date):
+            #> The default view is served from the statistics materialized by the updater
+            summary = journal_stats_cache.get(journal_abbr)
+        aggregated = False
+        if (summary is None) and (review_dates is None) and SERVER_SIDE_AGGREGATION:
+            #> Filter the articles and calculate intervals and their statistics in db
+            journal = Journal.objects.get(abbr_name=journal_abbr)
+            try:
+                summary, event_counts = stats.aggregate_review_intervals(journal, start_date, end_date)
+                aggregated = True
+            except OperationFailure:
+                #> $percentile and $dateDiff are not supported by MongoDB < 7.0,
+                #  calculate the statistics here instead (and from now on)
+                SERVER_SIDE_AGGREGATION = False
+        if aggregated:
+            if event_counts['total'] == 0:
+                return [html.H4("No data available")], [], {'display': 'none'}, {'display': 'none'}
+            missing_events = [event for event in stats.EVENTS if event_counts[event] == 0]
+            if missing_events:
+                missing_events_str = f"{' and '.join([event.title() for event in missing_events])} dates not reported"
+                return [html.H4(missing_events_str)], [], {'display': 'none'}, {'display': 'none'}
+        elif summary is None:
+            if review_dates is None:
+                #> Get review dates of the journal from db if it is too large to be cached
+                journal = Journal.objects.get(abbr_name=journal_abbr)
+                review_dates = stats.get_review_dates(journal)
+            if review_dates['published'].shape[0] == 0:
+                return [html.H4("No data available")], [], {'display': 'none'}, {'display': 'none'}
+            missing_events = stats.get_missing_events(review_dates)
+            if missing_events:
+                missing_events_str = f"{' and '.join([event.title() for event in missing_events])} dates not reported"
+                return [html.H4(missing_events_str)], [], {'display': 'none'}, {'display': 'none'}
+            #> Limit to start_date and end_date and drop NA dates (TODO: deal with NA values in a better way)
+            review_dates = stats.filter_review_dates(review_dates, start_date, end_date)
+            #> Calculate intervals and their statistics
+            summary = stats.summarize_review_intervals(review_dates)
         #> Create summary cards
-        if articles_df.shape[0] > 0:
-            cards = create_summary_cards(articles_df)
+        if summary is not None:
+            cards = create_summary_cards(summary)
             cards_row_content = [dbc.Col(card) for card in cards]
             #> Plot the graphs
-            histogram = plot_histogram(articles_df, plot_metric)
-            trend_graph = plot_trend(articles_df, plot_metric)
+            scatter_df = get_scatter_df(journal_abbr, start_date, end_date) if SHOW_SCATTER else None
+            histogram = plot_histogram(summary, plot_metric)
+            trend_graph = plot_trend(summary, plot_metric, scatter_df)
             graphs = [histogram, trend_graph]
             graphs_row_content = [dbc.Col(graph) for graph in graphs]
             return cards_row_content, graphs_row_content, {'display': 'inline'}, {'display': 'block'}
@@ -355,6 +464,28 @@ def show_journal_info(journal_abbr, plot_metric, start_date, end_date):
     else:
         return [], [], {'display': 'none'}, {'display': 'none'}
 
+def get_scatter_df(journal_abbr, start_date, end_date):
+    """
+    Gets the review speed data of individual articles for the scatter plot
+
+    Returns
+    ----------
+    scatter_df: (pandas.DataFrame) with doi, published and the intervals
+    """
+    journal = Journal.objects.get(abbr_name=journal_abbr)
+    articles = Article.objects.filter(journal=journal).only('doi', 'received', 'accepted', 'published')
+    scatter_df = pd.DataFrame([article.to_mongo().to_dict() for article in articles])
+    scatter_df = scatter_df.dropna(subset=stats.EVENTS)
+    for event in stats.EVENTS:
+        scatter_df[event] = pd.to_datetime(scatter_df[event])
+    if start_date:
+        scatter_df = scatter_df[scatter_df['published'] >= start_date]
+    if end_date:
+        scatter_df = scatter_df[scatter_df['published'] <= end_date]
+    for interval, (from_event, to_event) in stats.INTERVALS.items():
+        scatter_df[interval] = (scatter_df[to_event] - scatter_df[from_event]).dt.days
+    return scatter_df
+
 if __name__ == '__main__':
     app.run_server(host='localhost', debug=True)
     
\ No newline at end of file
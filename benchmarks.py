@@ -0,0 +1,275 @@
+"""
+Micro-benchmarks of the scraping steps, run against a corpus of publisher
+pages saved as <PAGES_DIR>/<publisher_domain>/<name>.html, of loading
+the articles data from the database, of the ingestion of a journal
+replayed from recorded responses (see replay.py), and of the date
+normalization (see dates.py)
+
+Usage: 
+    python benchmarks.py {regex,soap} [pages_dir]
+    python benchmarks.py dates [n_dates]
+    python benchmarks.py loader journal_abbr
+    REVIEW_SPEED_DB=mongomock://localhost/review_speed python benchmarks.py ingestion issn [fixtures_dir]
+"""
+import os, sys, time, re, random, datetime
+import xml.etree.ElementTree as ET
+
+from bs4 import BeautifulSoup
+import numpy as np
+import pandas as pd
+
+import scraper
+import stats
+import metrics
+import replay
+import dates
+from models import Article, Journal
+
+PAGES_DIR = os.path.join('tests', 'pages') # the test pages, or a larger corpus saved in the same layout
+
+def load_saved_pages(pages_dir=PAGES_DIR, publisher_domains=None):
+    """
+    Loads the saved publisher pages
+
+    Parameters
+    ----------
+    pages_dir: (str)
+    publisher_domains: (iterable or None) limit to these publishers
+
+    Returns
+    ----------
+    pages: (dict) publisher domain -> list of html strings
+    """
+    pages = {}
+    if not os.path.isdir(pages_dir):
+        return pages
+    for publisher_domain in sorted(os.listdir(pages_dir)):
+        if (publisher_domains is not None) and (publisher_domain not in publisher_domains):
+            continue
+        domain_dir = os.path.join(pages_dir, publisher_domain)
+        if not os.path.isdir(domain_dir):
+            continue
+        for filename in sorted(os.listdir(domain_dir)):
+            if filename.endswith('.html'):
+                with open(os.path.join(domain_dir, filename), 'rb') as f:
+                    pages.setdefault(publisher_domain, []).append(f.read().decode(errors='replace'))
+    return pages
+
+def time_function(function, inputs, repeats):
+    """
+    Returns the best total time (s) of calling function on all inputs over repeats
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for input in inputs:
+            function(input)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def legacy_regex_datestr_tuples(regex_pattern_dicts, html):
+    """
+    Reference implementation using one re.match per event and pattern set,
+    as get_dates did before the patterns were compiled
+    """
+    if not isinstance(regex_pattern_dicts, list):
+        regex_pattern_dicts = [regex_pattern_dicts]
+    results = []
+    for regex_pattern_dict in regex_pattern_dicts:
+        datestr_tuples = {}
+        for event, regex in regex_pattern_dict.items():
+            if regex is None:
+                continue
+            match = re.match(regex, html, flags=re.DOTALL)
+            if match:
+                datestr_tuples[event] = match.groups()
+        results.append(datestr_tuples)
+    return results
+
+def compiled_regex_datestr_tuples(compiled_regex_patterns, html):
+    """
+    Same as legacy_regex_datestr_tuples using scraper.COMPILED_REGEX_PATTERNS
+    """
+    results = []
+    for compiled_regex_pattern_dict in compiled_regex_patterns:
+        datestr_tuples = {}
+        for event, compiled_regex_pattern in compiled_regex_pattern_dict.items():
+            if compiled_regex_pattern is None:
+                continue
+            datestr_tuple = scraper.find_datestr_tuple(*compiled_regex_pattern, html)
+            if datestr_tuple is not None:
+                datestr_tuples[event] = datestr_tuple
+        results.append(datestr_tuples)
+    return results
+
+def benchmark_regex_extraction(pages_dir=PAGES_DIR, repeats=5):
+    """
+    Compares the speed and results of per-event re.match with the precompiled
+    anchored regex extraction for publishers in scraper.REGEX_PATTERNS
+    """
+    pages = load_saved_pages(pages_dir, scraper.REGEX_PATTERNS.keys())
+    if not pages:
+        print(f"No saved pages of regex-supported publishers found in {pages_dir}")
+        return
+    for publisher_domain, htmls in pages.items():
+        regex_pattern_dicts = scraper.REGEX_PATTERNS[publisher_domain]
+        compiled_regex_patterns = scraper.COMPILED_REGEX_PATTERNS[publisher_domain]
+        mismatches = sum(
+            legacy_regex_datestr_tuples(regex_pattern_dicts, html) != compiled_regex_datestr_tuples(compiled_regex_patterns, html)
+            for html in htmls)
+        legacy_time = time_function(lambda html: legacy_regex_datestr_tuples(regex_pattern_dicts, html), htmls, repeats)
+        compiled_time = time_function(lambda html: compiled_regex_datestr_tuples(compiled_regex_patterns, html), htmls, repeats)
+        print(f"{publisher_domain}: {len(htmls)} pages, re.match {legacy_time*1000/len(htmls):.2f} ms/page, "
+              f"compiled {compiled_time*1000/len(htmls):.2f} ms/page ({legacy_time/compiled_time:.1f}x), "
+              f"{mismatches} mismatches")
+
+def soap_dates(soap_function, html, strainer=None):
+    """
+    Parses the html (restricted to strainer) and returns the output of soap_function,
+    or the name of the exception if it failed
+    """
+    try:
+        return soap_function(BeautifulSoup(html, features='html.parser', parse_only=strainer))
+    except Exception as e:
+        return type(e).__name__
+
+def benchmark_soap_extraction(pages_dir=PAGES_DIR, repeats=3):
+    """
+    Compares the speed and results of parsing the whole html with parsing only
+    the elements in scraper.SOAP_STRAINERS for publishers in scraper.SOAP_FUNCITONS
+    """
+    pages = load_saved_pages(pages_dir, scraper.SOAP_FUNCITONS.keys())
+    if not pages:
+        print(f"No saved pages of soap-supported publishers found in {pages_dir}")
+        return
+    for publisher_domain, htmls in pages.items():
+        soap_function = scraper.SOAP_FUNCITONS[publisher_domain]
+        strainer = scraper.SOAP_STRAINERS.get(publisher_domain)
+        mismatches = sum(
+            soap_dates(soap_function, html) != soap_dates(soap_function, html, strainer)
+            for html in htmls)
+        full_time = time_function(lambda html: soap_dates(soap_function, html), htmls, repeats)
+        strained_time = time_function(lambda html: soap_dates(soap_function, html, strainer), htmls, repeats)
+        print(f"{publisher_domain}: {len(htmls)} pages, full parse {full_time*1000/len(htmls):.2f} ms/page, "
+              f"strained parse {strained_time*1000/len(htmls):.2f} ms/page ({full_time/strained_time:.1f}x), "
+              f"{mismatches} mismatches")
+
+def legacy_review_dates_df(journal):
+    """
+    Reference implementation creating an Article document per row and converting
+    it back to dict, as the app did before stats.get_review_dates
+    """
+    articles = Article.objects.filter(journal=journal).only(*stats.EVENTS)
+    articles_df = pd.DataFrame([article.to_mongo().to_dict() for article in articles])
+    for event in stats.EVENTS:
+        articles_df[event] = pd.to_datetime(articles_df[event])
+    return articles_df
+
+def benchmark_review_dates_loading(journal_abbr, repeats=3):
+    """
+    Compares loading the review dates of a journal as Article documents
+    with the columnar loader in stats.get_review_dates
+    """
+    journal = Journal.objects.get(abbr_name=journal_abbr)
+    legacy_df = legacy_review_dates_df(journal)
+    review_dates = stats.get_review_dates(journal)
+    mismatches = sum(
+        (legacy_df[event].values.astype('datetime64[D]') != review_dates[event]).sum() 
+        - (np.isnat(review_dates[event])).sum() # NaT != NaT
+        for event in stats.EVENTS)
+    legacy_time = time_function(legacy_review_dates_df, [journal], repeats)
+    loader_time = time_function(stats.get_review_dates, [journal], repeats)
+    print(f"{journal_abbr}: {legacy_df.shape[0]} articles, documents {legacy_time*1000:.1f} ms, "
+          f"columnar {loader_time*1000:.1f} ms ({legacy_time/loader_time:.1f}x), {mismatches} mismatches")
+
+def benchmark_ingestion(issn, fixtures_dir=replay.FIXTURES_DIR, repeats=3):
+    """
+    Replays the recorded ingestion of a journal into an empty mongomock database,
+    and reports the throughput of each repeat and the wall and CPU time of
+    each stage in the last repeat
+    """
+    for repeat in range(repeats):
+        metrics.reset_metrics()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        with replay.patched_http(fixtures_dir, 'replay') as store:
+            journal = replay.ingest_journal(issn)
+        elapsed, cpu_time = time.perf_counter() - start, time.process_time() - cpu_start
+        if journal is None:
+            print(f"{issn}: journal not found in the recorded responses")
+            return
+        n_articles = Article.objects.count()
+        print(f"{journal.abbr_name} ({repeat+1} of {repeats}): {n_articles} articles in {elapsed:.2f} s "
+              f"({n_articles/elapsed:.1f} articles/s, CPU {cpu_time:.2f} s), {len(store.misses)} missing responses")
+    print(f"{'stage':<16}{'domain':<16}{'count':>8}{'errors':>8}{'wall (s)':>10}{'CPU (s)':>10}{'KB':>10}")
+    for stage_metrics in metrics.get_metrics()['stages']:
+        print(f"{stage_metrics['stage']:<16}{stage_metrics['domain']:<16}{stage_metrics['count']:>8}{stage_metrics['errors']:>8}"
+              f"{stage_metrics['seconds']:>10.3f}{stage_metrics['cpu_seconds']:>10.3f}{stage_metrics['bytes']/1024:>10.1f}")
+
+def legacy_datestr_tuple_to_datetime(datestr_tuple, pattern):
+    """
+    Reference implementation using datetime.strptime for month names,
+    as in helpers before dates.py
+    """
+    for datestr_idx in range(3):
+        if pattern[datestr_idx] == 'B': # Month name full
+            month = datetime.datetime.strptime(datestr_tuple[datestr_idx], '%B').month
+        elif pattern[datestr_idx] == 'b': # Month name short
+            month = datetime.datetime.strptime(datestr_tuple[datestr_idx], '%b').month
+        elif pattern[datestr_idx] == 'm':
+            month = int(datestr_tuple[datestr_idx])
+        elif pattern[datestr_idx] == 'd':
+            day = int(datestr_tuple[datestr_idx])
+        elif pattern[datestr_idx] == 'Y':
+            year = int(datestr_tuple[datestr_idx])
+    return datetime.datetime(year, month, day)
+
+def legacy_pubmed_date_to_datetime(date_element):
+    """
+    Reference implementation of dates.pubmed_date_to_datetime, as in helpers before dates.py
+    """
+    year = int(date_element.find('Year').text)
+    month = int(date_element.find('Month').text)
+    day = int(date_element.find('Day').text)
+    return datetime.datetime(year, month, day)
+
+def benchmark_date_normalization(n_dates=100000, repeats=3):
+    """
+    Compares the date normalization in dates.py (with cold and warm caches)
+    with the legacy strptime-based functions on random dates of the publisher
+    datestr patterns and on PubMed date elements. Their outputs are compared
+    in tests/test_dates.py
+    """
+    n_dates, repeats = int(n_dates), int(repeats)
+    random.seed(0)
+    first_day = datetime.date(2015, 1, 1).toordinal()
+    random_dates = [datetime.date.fromordinal(first_day + random.randrange(3650)) for _ in range(n_dates)]
+    for pattern in sorted(set(scraper.DATESTR_PATTERNS.values()) | {'dbY'}):
+        datestr_tuples = [
+            tuple(random_date.strftime(f'%{code}') for code in pattern)
+            for random_date in random_dates]
+        legacy_time = time_function(lambda datestr_tuple: legacy_datestr_tuple_to_datetime(datestr_tuple, pattern), datestr_tuples, repeats)
+        dates.datestr_tuple_to_ymd.cache_clear()
+        cold_time = time_function(lambda datestr_tuple: dates.datestr_tuple_to_datetime(datestr_tuple, pattern), datestr_tuples, 1)
+        warm_time = time_function(lambda datestr_tuple: dates.datestr_tuple_to_datetime(datestr_tuple, pattern), datestr_tuples, repeats)
+        print(f"{pattern}: legacy {legacy_time*1e6/n_dates:.2f} us/date, cold cache {cold_time*1e6/n_dates:.2f} us/date "
+              f"({legacy_time/cold_time:.1f}x), warm cache {warm_time*1e6/n_dates:.2f} us/date ({legacy_time/warm_time:.1f}x)")
+    date_elements = [
+        ET.fromstring(f'<PubMedPubDate PubStatus="received"><Year>{random_date.year}</Year>'
+                      f'<Month>{random_date.month}</Month><Day>{random_date.day}</Day></PubMedPubDate>')
+        for random_date in random_dates]
+    legacy_time = time_function(legacy_pubmed_date_to_datetime, date_elements, repeats)
+    new_time = time_function(dates.pubmed_date_to_datetime, date_elements, repeats)
+    print(f"pubmed: legacy {legacy_time*1e6/n_dates:.2f} us/date, new {new_time*1e6/n_dates:.2f} us/date "
+          f"({legacy_time/new_time:.1f}x)")
+
+BENCHMARKS = {
+    'regex': benchmark_regex_extraction,
+    'soap': benchmark_soap_extraction,
+    'loader': benchmark_review_dates_loading,
+    'ingestion': benchmark_ingestion,
+    'dates': benchmark_date_normalization,
+}
+
+if __name__ == '__main__':
+    benchmark_name = sys.argv[1] if len(sys.argv) > 1 else 'regex'
+    BENCHMARKS[benchmark_name](*sys.argv[2:])
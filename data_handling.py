@@ -7,31 +7,283 @@ from bs4 import BeautifulSoup
 import tldextract
 import xml.etree.ElementTree as ET 
 import pandas as pd
-import os, time, datetime
+import os, re, time, datetime, itertools
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect
 
 import scraper
-from models import Publisher, BroadSubjectTerm, Journal, Article
-from helpers import download_file, pubmed_date_to_datetime
+import stats
+import rate_limit
+import metrics
+from models import Publisher, BroadSubjectTerm, Journal, Article, UpdaterRun, FailedArticle
+from helpers import download_file, iterparse_elements
+from dates import pubmed_date_to_datetime
 
 SCIMAGOJR_BASE = 'https://www.scimagojr.com/journalrank.php'
 JOURNALS_LIST_PATH = os.path.join('data', 'journals_list.txt')
 GIVE_UP_LIMIT = 15
+EUTILS_BASE = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+EFETCH_BATCH_SIZE = 200 # number of pmids fetched in a single efetch request
+ESEARCH_PAGE_SIZE = 1000 # number of ids retrieved from history server in a single esearch request
+ESEARCH_MAX_RESULTS = 9999 # PubMed esearch only returns the first 10,000 results (retstart <= 9998)
+BULK_WRITE_SIZE = 500 # number of article writes buffered before sending them to the database
+NLMCATALOG_BATCH_SIZE = 200 # number of NLM Catalog records fetched in a single efetch request
+STREAM_CHUNK_SIZE = 64 * 1024 # bytes of a streamed response parsed at once
+CHECKPOINT_INTERVAL = 100 # number of processed pmids between the checkpoints of the pmid cursor
+FAILED_RETRY_INTERVAL = 7 # days until the first retry of an article which failed, doubled after each attempt
+FAILED_RETRY_MAX_INTERVAL = 180 # days
+#> Reasons of failures which are retried after a fixed interval (days) instead of the backoff
+FAILED_FIXED_RETRY_INTERVALS = {
+    'not_in_pubmed': FAILED_RETRY_MAX_INTERVAL, # e.g. deleted pmids and book records
+    'page_fetch_failed': 1, # the publisher could not be reached or blocked the request
+}
+#> Reasons of failures which are not counted as attempts to extract the dates
+FAILED_TRANSIENT_REASONS = ['page_fetch_failed']
 
-def search_nlmcatalog(term, retmax=100000):
-    #> Search in NLM Catalog using ISSN
-    search_url = f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=nlmcatalog&retmax={retmax}&term={term}'
-    search_succeeded = False
+class EutilsError(RuntimeError):
+    """
+    Error returned by an E-utility in the <ERROR> element of its response,
+    which is not resolved by retrying the request
+    """
+
+class PubmedArticleNotFound(Exception):
+    """
+    Raised when an efetch of a pmid succeeds without a PubmedArticle, e.g. for
+    deleted pmids and PubmedBookArticle records
+    """
+
+def eutils_request(utility, params, method='get'):
+    """
+    Sends a request to an E-utility with up to 10 retries, within the NCBI rate
+    limit which is shared by all threads (using NCBI_API_KEY if it is set)
+
+    Parameters
+    ----------
+    utility: (str) name of the E-utility, e.g. 'esearch' or 'efetch'
+    params: (dict) query parameters of the request
+    method: (str) 'get' or 'post'. POST should be used for long lists of ids
+
+    Returns
+    ----------
+    res_root: (xml.etree.ElementTree.Element or None) root of the XML response,
+        None if the request failed after 10 retries
+    """
+    url = f'{EUTILS_BASE}{utility}.fcgi'
+    if rate_limit.NCBI_API_KEY:
+        params = dict(params, api_key=rate_limit.NCBI_API_KEY)
     retries = 0
-    while (retries < 10) and (not search_succeeded):
+    while retries < 10:
+        rate_limit.ncbi_limiter.acquire()
         try:
-            search_res_xml = requests.get(search_url).text
-            search_res_root = ET.fromstring(search_res_xml)
+            with metrics.timed(utility, 'ncbi') as record:
+                if method == 'post':
+                    res = requests.post(url, data=params)
+                else:
+                    res = requests.get(url, params=params)
+                record['bytes'] = len(res.content)
+                return ET.fromstring(res.text)
         except:
             retries += 1
             time.sleep(.2)
-        else:
-            search_succeeded = True
-    return search_res_root
+    return None
+
+def eutils_stream(utility, params, tags, method='get'):
+    """
+    Sends a request to an E-utility like eutils_request, but parses the
+    response while it is downloaded and yields the elements with the given
+    tags as soon as they are complete, without holding the response or
+    its full tree in memory. If the request fails midway it is retried,
+    skipping the elements which were already yielded
+
+    Parameters
+    ----------
+    utility: (str) name of the E-utility, e.g. 'esearch' or 'efetch'
+    params: (dict) query parameters of the request
+    tags: (list of str) e.g. ['Id'] or ['PubmedArticle']
+    method: (str) 'get' or 'post'. POST should be used for long lists of ids
+
+    Yields
+    ----------
+    element: (xml.etree.ElementTree.Element) which is cleared after it is processed
+
+    Raises
+    ----------
+    RuntimeError if the request failed after 10 retries, or EutilsError
+    if the response has an <ERROR> element
+    """
+    url = f'{EUTILS_BASE}{utility}.fcgi'
+    if rate_limit.NCBI_API_KEY:
+        params = dict(params, api_key=rate_limit.NCBI_API_KEY)
+    n_yielded = 0
+    retries = 0
+    while retries < 10:
+        rate_limit.ncbi_limiter.acquire()
+        #> Record the time of the request excluding the processing of the yielded elements
+        record = {'bytes': 0, 'seconds': 0.0, 'cpu_seconds': 0.0}
+        def read_chunks(res):
+            for chunk in res.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                record['bytes'] += len(chunk)
+                yield chunk
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        n_parsed = 0
+        res = None
+        error = False
+        try:
+            if method == 'post':
+                res = requests.post(url, data=params, stream=True)
+            else:
+                res = requests.get(url, params=params, stream=True)
+            for element in iterparse_elements(read_chunks(res), tags + ['ERROR']):
+                if element.tag == 'ERROR':
+                    raise EutilsError(f"{utility} error: {element.text}")
+                n_parsed += 1
+                if n_parsed > n_yielded:
+                    record['seconds'] += time.perf_counter() - start
+                    record['cpu_seconds'] += time.thread_time() - cpu_start
+                    yield element
+                    n_yielded += 1
+                    start, cpu_start = time.perf_counter(), time.thread_time()
+        except EutilsError:
+            error = True
+            raise
+        except Exception:
+            error = True
+        finally:
+            metrics.observe(utility, 'ncbi', record['seconds'] + time.perf_counter() - start, 
+                record['cpu_seconds'] + time.thread_time() - cpu_start, record['bytes'], n_parsed, error)
+            if res is not None:
+                res.close()
+        if not error:
+            return
+        retries += 1
+        time.sleep(.2)
+    raise RuntimeError(f"{utility} failed after 10 retries")
+
+def esearch_history(db, term, **params):
+    """
+    Runs an esearch and stores its results on the E-utilities history server
+
+    Parameters
+    ----------
+    db: (str) e.g. 'pubmed' or 'nlmcatalog'
+    term: (str) search term (not url-encoded)
+    **params: additional esearch parameters, e.g. mindate and maxdate
+
+    Returns
+    ----------
+    history: (dict or None) with 'count', 'WebEnv' and 'query_key',
+        None if the search failed
+    """
+    search_res_root = eutils_request('esearch', dict(db=db, term=term, usehistory='y', retmax=0, **params))
+    if (search_res_root is None) or (search_res_root.find('WebEnv') is None):
+        return None
+    return {
+        'count': int(search_res_root.find('Count').text),
+        'WebEnv': search_res_root.find('WebEnv').text,
+        'query_key': search_res_root.find('QueryKey').text,
+    }
+
+def iter_esearch_ids(db, history, page_size=ESEARCH_PAGE_SIZE, max_results=0, start=0):
+    """
+    Pages through the ids of a search stored on the history server
+
+    Parameters
+    ----------
+    db: (str)
+    history: (dict) output of esearch_history
+    page_size: (int) number of ids retrieved per request
+    max_results: (int) maximum number of ids to retrieve, 0 will get all the ids
+    start: (int) index of the first id to retrieve
+
+    Yields
+    ----------
+    ids: (list of str) ids of the next page
+    """
+    total = history['count']
+    if max_results:
+        total = min(total, max_results)
+    for retstart in range(start, total, page_size):
+        retmax = min(page_size, total-retstart)
+        try:
+            ids = [element.text for element in eutils_stream('esearch', dict(
+                db=db, WebEnv=history['WebEnv'], query_key=history['query_key'],
+                retstart=retstart, retmax=retmax), ['Id'])]
+        except RuntimeError as e:
+            raise RuntimeError(f"esearch history paging failed at retstart={retstart}: {e}")
+        #> Do not silently truncate the results
+        if len(ids) < retmax:
+            raise RuntimeError(f"esearch history paging returned {len(ids)} of {retmax} ids at retstart={retstart}")
+        yield ids
+
+def esearch_histories(db, term, max_count=ESEARCH_MAX_RESULTS, **params):
+    """
+    Runs an esearch on the history server like esearch_history, and if it has
+    more than max_count results (which PubMed does not page through) splits 
+    it into searches of consecutive Entrez date ranges with at most max_count results
+
+    Parameters
+    ----------
+    db: (str)
+    term: (str)
+    max_count: (int)
+    **params: additional esearch parameters, e.g. datetype='edat', mindate and maxdate
+
+    Returns
+    ----------
+    histories: (list of dict or None) outputs of esearch_history, with the most
+        recent date range first (as the results are sorted), None if a search failed
+    """
+    history = esearch_history(db, term, **params)
+    if history is None:
+        return None
+    if history['count'] <= max_count:
+        return [history]
+    #> Split the Entrez date range in halves
+    mindate = datetime.date(1800, 1, 1)
+    maxdate = datetime.date.today() + datetime.timedelta(days=1)
+    if params.get('datetype') == 'edat':
+        mindate = datetime.datetime.strptime(params['mindate'], '%Y/%m/%d').date()
+        if params['maxdate'] != '3000':
+            maxdate = datetime.datetime.strptime(params['maxdate'], '%Y/%m/%d').date()
+    if mindate >= maxdate:
+        raise RuntimeError(f"More than {max_count} results of {term} on {mindate}")
+    middate = mindate + (maxdate - mindate) // 2
+    histories = []
+    for part_mindate, part_maxdate in [(middate + datetime.timedelta(days=1), maxdate), (mindate, middate)]:
+        part_histories = esearch_histories(db, term, max_count, **dict(params, 
+            datetype='edat', mindate=part_mindate.strftime('%Y/%m/%d'), maxdate=part_maxdate.strftime('%Y/%m/%d')))
+        if part_histories is None:
+            return None
+        histories += part_histories
+    return histories
+
+def iter_esearch_histories_ids(db, histories, page_size=ESEARCH_PAGE_SIZE, max_results=0, start=0):
+    """
+    Pages through the ids of consecutive searches stored on the history server,
+    e.g. the output of esearch_histories, as if they were a single search
+
+    Parameters
+    ----------
+    db: (str)
+    histories: (list of dict)
+    page_size: (int) number of ids retrieved per request
+    max_results: (int) maximum number of ids to retrieve, 0 will get all the ids
+    start: (int) index of the first id to retrieve
+
+    Yields
+    ----------
+    ids: (list of str) ids of the next page
+    """
+    remaining = max_results
+    for history in histories:
+        count = min(history['count'], remaining) if max_results else history['count']
+        if start < count:
+            yield from iter_esearch_ids(db, history, page_size, max_results=count, start=start)
+        start = max(start - count, 0)
+        if max_results:
+            remaining -= count
+            if remaining <= 0:
+                break
 
 def fetch_broad_subject_terms():
     """
@@ -46,15 +298,81 @@ def fetch_broad_subject_terms():
             if len(BroadSubjectTerm.objects.filter(name=a.text)) == 0:
                 broad_subject_term = BroadSubjectTerm(name=a.text).save()
 
-def fetch_journals_info_from_nlmcatalog(broad_subject_term_name='', issn='', verbosity='full'):
+def parse_nlmcatalog_record(record, verbosity='full'):
+    """
+    Parses the journal info from an NLM Catalog record
+
+    Parameters
+    ----------
+    record: (xml.etree.ElementTree.Element) NLMCatalogRecord element
+    verbosity: (str or None) 'full' prints why a record is skipped
+
+    Returns
+    ----------
+    journal_info: (dict or None) with full_name, abbr_name, issns, pmc_url and journal_url,
+        None if the record has no title, MedlineTA, ISSN or pmc/journal url
+    """
+    #>> full_name from TitleMain
+    if record.find('TitleMain') is None:
+        if verbosity=='full':
+            print(f"No TitleMain")
+        return None
+    full_name = record.find('TitleMain').find('Title').text
+    full_name = full_name.rstrip('.') # Remove the trailing "." from the name of some journals
+    #>> abbr_name from MedlineTA
+    if record.find('MedlineTA') is None:
+        if verbosity=='full':
+            print(f"No MedlineTA")
+        return None
+    abbr_name = record.find('MedlineTA').text
+    #> get ISSNs
+    issns = [node.text for node in record.findall('ISSN')]
+    if not issns:
+        if verbosity=='full':
+            print(f"No ISSN")
+        return None
+    #> Get the journal and pmc url (if exists)
+    pmc_url = journal_url = ''
+    if record.find('ELocationList') is not None:
+        for ELocation in record.find('ELocationList').findall('ELocation'):
+            if ELocation.find('ELocationID') is not None:
+                ELocation_url = ELocation.find('ELocationID').text
+                if ELocation_url.startswith('https://www.ncbi.nlm.nih.gov/pmc/journals'):
+                    pmc_url = ELocation_url
+                else:
+                    journal_url = ELocation_url
+    if (pmc_url=='') and (journal_url==''):
+        if verbosity=='full':
+            print(f"No pmc/journal url")
+        return None
+    return {
+        'full_name': full_name,
+        'abbr_name': abbr_name,
+        'issns': issns,
+        'pmc_url': pmc_url,
+        'journal_url': journal_url,
+    }
+
+def normalize_nlmcatalog_id(nlmcatalog_id):
+    """
+    Normalizes NLM Catalog ids (esearch uids) and NlmUniqueIDs for matching them,
+    e.g. "0372435" and "372435"
+    """
+    return re.sub(r'\D', '', nlmcatalog_id).lstrip('0')
+
+def fetch_journals_info_from_nlmcatalog(broad_subject_term_name='', issn='', batch_size=NLMCATALOG_BATCH_SIZE, verbosity='full'):
     """
     Fetch journal and publisher info for all the journals 
-    on nlmcatalog and add them/it to database
+    on nlmcatalog and add them/it to database. The existing journals are found
+    in a single query, the catalog records of the new journals are fetched in 
+    batches, and the journals and their links to publishers (and the subject term)
+    are written in bulk per batch. Re-running it skips the existing journals
 
     Parameters
     ----------
     broad_subject_term: (str) BroadSubjectTerm names based on NLM Catalog for MEDLINE
     issn: (str)
+    batch_size: (int) number of catalog records fetched and written together
     verbosity: (str or None) 'full' will print all dois, 'summary' prints the counter every 5 articles, None prints nothing
 
     Returns
@@ -62,104 +380,80 @@ def fetch_journals_info_from_nlmcatalog(broad_subject_term_name='', issn='', ver
     None
     """
     if broad_subject_term_name:
-        term = f'{broad_subject_term_name}%5Bst%5D'
+        term = f'{broad_subject_term_name}[st]'
     elif issn:
-        term = f'"{issn}"%5BISSN%5D'
+        term = f'"{issn}"[ISSN]'
     else: #> get all
         term = 'currentlyindexed'
-    search_res_root = search_nlmcatalog(term=term)
-    #> Get the NLM Catalogy IDs
-    nlmcatalog_ids = [element.text for element in search_res_root.findall('IdList')[0].getchildren()]
+    #> Get the NLM Catalogy IDs page by page from the history server
+    history = esearch_history('nlmcatalog', term)
+    if history is None:
+        print("NLM Catalog search failed after 10 retries")
+        return
+    nlmcatalog_ids = list(itertools.chain.from_iterable(iter_esearch_ids('nlmcatalog', history)))
     if broad_subject_term_name:
         broad_subject_term = BroadSubjectTerm.objects.get(name=broad_subject_term_name)
     else:
         broad_subject_term = None
-    for idx, nlmcatalog_id in enumerate(nlmcatalog_ids):
-        if verbosity=='full':
-            print(f'{idx+1} of {len(nlmcatalog_ids)}: {nlmcatalog_id}')
-        elif verbosity=='summary' and ((idx+1)%5==0):
-            print(f'{idx+1} of {len(nlmcatalog_ids)}')
-        #> Check if journal already exist and avoid adding it
-        #  but add the current subject term to the journal if it's new
-        journal_Q = Journal.objects.allow_disk_use(True).filter(nlmcatalog_id=nlmcatalog_id)
-        if journal_Q.count() > 0:
-            if broad_subject_term:
-                journal = journal_Q[0]
-                if broad_subject_term not in journal.broad_subject_terms:
-                    broad_subject_term.update(push__journals=journal)
-            print('Already exists in db')
-            continue
-        journal_url = f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=nlmcatalog&rettype=xml&id={nlmcatalog_id}'
-        fetch_succeeded = False
-        retries = 0
-        while (retries < 10) and (not fetch_succeeded):
-            try:
-                journal_res_xml = requests.get(journal_url, headers=scraper.REQUESTS_AGENT_HEADERS).text
-                journal_res_root = ET.fromstring(journal_res_xml)
-            except:
-                time.sleep(.2)
-                retries += 1
-            else:
-                fetch_succeeded = True
-        #>> full_name from TitleMain
-        if len(journal_res_root.find('NLMCatalogRecord').findall('TitleMain')) > 0:
-            full_name = journal_res_root.find('NLMCatalogRecord').find('TitleMain').find('Title').text
-            full_name = full_name.rstrip('.') # Remove the trailing "." from the name of some journals
-        else:
-            if verbosity=='full':
-                print(f"No TitleMain")
-            continue
-        #>> abbr_name from MedlineTA
-        if len(journal_res_root.find('NLMCatalogRecord').findall('MedlineTA')) > 0:
-            abbr_name = journal_res_root.find('NLMCatalogRecord').find('MedlineTA').text
-        else:
-            if verbosity=='full':
-                print(f"No MedlineTA")
-            continue
-        #> get ISSNs
-        if len(journal_res_root.find('NLMCatalogRecord').findall('ISSN')) > 0:
-            issns = [node.text for node in journal_res_root.find('NLMCatalogRecord').findall('ISSN')]
-        else:
-            if verbosity=='full':
-                print(f"No ISSN")
+    #> Check which journals already exist in a single query
+    existing_journal_ids = dict(Journal.objects(nlmcatalog_id__in=nlmcatalog_ids).scalar('nlmcatalog_id', 'id'))
+    new_nlmcatalog_ids = [nlmcatalog_id for nlmcatalog_id in nlmcatalog_ids if nlmcatalog_id not in existing_journal_ids]
+    if verbosity:
+        print(f'{len(nlmcatalog_ids)} journals found, {len(existing_journal_ids)} already exist in db')
+    #> Add the current subject term to the existing journals
+    if broad_subject_term and existing_journal_ids:
+        broad_subject_term.update(add_to_set__journals=list(existing_journal_ids.values()))
+    for batch_start in range(0, len(new_nlmcatalog_ids), batch_size):
+        batch_ids = new_nlmcatalog_ids[batch_start:batch_start+batch_size]
+        if verbosity:
+            print(f'{batch_start+len(batch_ids)} of {len(new_nlmcatalog_ids)} new journals')
+        #> Parse the records as they are streamed, matched to the requested ids by their NlmUniqueID
+        batch_ids_by_normalized = {normalize_nlmcatalog_id(nlmcatalog_id): nlmcatalog_id for nlmcatalog_id in batch_ids}
+        journals = []
+        journal_urls = []
+        try:
+            for record in eutils_stream('efetch', {'db': 'nlmcatalog', 'rettype': 'xml', 'id': ','.join(batch_ids)}, ['NLMCatalogRecord'], method='post'):
+                nlmcatalog_id = batch_ids_by_normalized.get(normalize_nlmcatalog_id(record.findtext('NlmUniqueID', '')))
+                if nlmcatalog_id is None:
+                    continue
+                journal_info = parse_nlmcatalog_record(record, verbosity=verbosity)
+                if journal_info is None:
+                    continue
+                journal_urls.append(journal_info.pop('journal_url'))
+                journals.append(Journal(nlmcatalog_id=nlmcatalog_id, **journal_info))
+        except RuntimeError:
+            print(f"NLM Catalog fetch failed after 10 retries, skipping {len(batch_ids)} journals")
             continue
-        #> Get the journal and pmc url (if exists)
-        pmc_url = journal_url = ''
-        if len(journal_res_root.find('NLMCatalogRecord').findall('ELocationList')) > 0:
-            for ELocation in journal_res_root.find('NLMCatalogRecord').find('ELocationList').findall('ELocation'):
-                if len(ELocation.findall('ELocationID'))>0:
-                    ELocation_url = ELocation.find('ELocationID').text
-                    if ELocation_url.startswith('https://www.ncbi.nlm.nih.gov/pmc/journals'):
-                        pmc_url = ELocation_url
-                    else:
-                        journal_url = ELocation_url
-        if (pmc_url=='') and (journal_url==''):
-            print(f"No pmc/journal url")
+        if not journals:
             continue
-        #> Add the journal
-        journal = Journal(
-            full_name=full_name, 
-            abbr_name=abbr_name, 
-            issns=issns,
-            nlmcatalog_id=nlmcatalog_id,
-            pmc_url=pmc_url).save()
-        #> Get the publisher url and domain from journal url
-        if journal_url:
-            journal_url_extract = tldextract.extract(journal_url)
-            publisher_url = journal_url_extract.fqdn
-            publisher_domain = journal_url_extract.domain
-            #> Check if publisher is supported
-            publisher_supported = publisher_domain in scraper.SUPPORTED_DOMAINS
-            #> Create Publisher (if does not exist) and Journal database instances
-            publisher_Q = Publisher.objects.filter(domain=publisher_domain)
-            if publisher_Q.count() == 0:
-                publisher = Publisher(
-                    domain=publisher_domain, 
-                    url=publisher_url, 
-                    supported=publisher_supported).save()
-            else:
-                publisher = publisher_Q[0]
-            publisher.update(push__journals=journal)
+        #> Add the journals
+        journal_ids = Journal.objects.insert(journals, load_bulk=False)
+        #> Link the journals to their publishers, creating the publishers which do not exist
+        publishers = {}
+        for journal_id, journal_url in zip(journal_ids, journal_urls):
+            if journal_url:
+                #> Get the publisher url and domain from journal url
+                journal_url_extract = tldextract.extract(journal_url)
+                publisher = publishers.setdefault(journal_url_extract.domain, {
+                    'url': journal_url_extract.fqdn, 'journal_ids': []})
+                publisher['journal_ids'].append(journal_id)
+        if publishers:
+            Publisher._get_collection().bulk_write([
+                UpdateOne(
+                    {'domain': publisher_domain},
+                    {
+                        '$setOnInsert': {
+                            'url': publisher['url'],
+                            #> Check if publisher is supported
+                            'supported': publisher_domain in scraper.SUPPORTED_DOMAINS
+                        },
+                        '$addToSet': {'journals': {'$each': publisher['journal_ids']}}
+                    },
+                    upsert=True)
+                for publisher_domain, publisher in publishers.items()
+            ], ordered=False)
+        if broad_subject_term:
+            broad_subject_term.update(add_to_set__journals=journal_ids)
 
 # def resolve_duplicated_journal_abbr_names():
 #     """
@@ -193,6 +487,10 @@ def update_supported_publishers():
         n_journals = len(publisher.journals)
         supported_journals += n_journals
         print(f"{publisher.domain} with {n_journals} journals is supported")
+        if not publisher.supported:
+            #> Retry the articles of the newly supported publisher
+            n_cleared = clear_failed_articles(publisher_domain=publisher_domain)
+            print(f"{n_cleared} failed articles of {publisher.domain} cleared")
         publisher.supported=True
         publisher.save()
     for publisher in Publisher.objects.filter(supported=True):
@@ -202,37 +500,33 @@ def update_supported_publishers():
             publisher.save()
     print(f"{supported_journals} of a total number of {Journal.objects.count()} journals in database are supported")
 
-def get_data_pubmed(pmid, verbosity='full', logger=None):
+def parse_pubmed_article(pubmed_article, verbosity='full', logger=None):
     """
-    Get the dates of an article from PubMed
+    Parses the dates and metadata of a single PubmedArticle element
+
+    Parameters
+    ----------
+    pubmed_article: (xml.etree.ElementTree.Element) PubmedArticle element of an efetch response
+    verbosity: (str or None)
+    logger: (Logger or None)
+
+    Returns
+    ----------
+    dates: (dict) datetime.datetime objs (or None) for Received, Revised, Accepted and Published
+    metadata: (dict) doi, title and authors of the article
     """
     # note: revised date might not be available or might reflect changes in versions of the article
     # rather than revisions in the review process
     dates = {'Received':None, 'Revised':None, 'Accepted':None, 'Published':None}
     metadata = {}
-    url = f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pubmed&id={pmid}'
-    fetch_succeeded = False
-    retries = 0
-    while (retries < 10) and (not fetch_succeeded):
-        try:
-            res_xml = requests.get(url).text
-            res_root = ET.fromstring(res_xml)
-        except:
-            time.sleep(.2)
-            retries += 1
-        else:
-            fetch_succeeded = True
-    if not fetch_succeeded:
-        if verbosity=='full': logger.info("Pubmed fetch failed after 10 retries")
-        return dates, metadata
     # get metadata
     ## doi  
     metadata['doi'] = ''  
-    for articleid_element in res_root.find('PubmedArticle').find('PubmedData').find('ArticleIdList').findall('ArticleId'):
+    for articleid_element in pubmed_article.find('PubmedData').find('ArticleIdList').findall('ArticleId'):
         if articleid_element.get("IdType")=="doi":
             metadata['doi'] = articleid_element.text
     ## title
-    article = res_root.find('PubmedArticle').find('MedlineCitation').find('Article')
+    article = pubmed_article.find('MedlineCitation').find('Article')
     metadata['title'] = article.find('ArticleTitle').text
     ## authors
     metadata['authors'] = []
@@ -247,7 +541,7 @@ def get_data_pubmed(pmid, verbosity='full', logger=None):
         author['affiliation'] = '; '.join(author['affiliation'])
         metadata['authors'].append(author)
     try:
-        date_elements = res_root.find('PubmedArticle').find('PubmedData').find('History').findall('PubMedPubDate')
+        date_elements = pubmed_article.find('PubmedData').find('History').findall('PubMedPubDate')
     except AttributeError as e:
         if verbosity=='full': logger.info("No pubmed dates data")
         return dates, metadata
@@ -265,8 +559,167 @@ def get_data_pubmed(pmid, verbosity='full', logger=None):
                     None)))
     return dates, metadata
 
+def get_data_pubmed(pmid, verbosity='full', logger=None):
+    """
+    Get the dates of an article from PubMed
+
+    Raises
+    ----------
+    RuntimeError if the fetch failed after 10 retries
+    PubmedArticleNotFound if the response has no PubmedArticle
+    AttributeError or TypeError if the article is missing pubmed metadata
+    """
+    for pubmed_article in eutils_stream('efetch', {'db': 'pubmed', 'id': pmid}, ['PubmedArticle']):
+        return parse_pubmed_article(pubmed_article, verbosity=verbosity, logger=logger)
+    raise PubmedArticleNotFound(f"No PubmedArticle in the response for {pmid}")
+
+def get_data_pubmed_batch(pmids, verbosity='full', logger=None):
+    """
+    Get the dates and metadata of multiple articles from PubMed
+    using a single efetch POST request
+
+    Parameters
+    ----------
+    pmids: (list of str) at most EFETCH_BATCH_SIZE pmids
+    verbosity: (str or None)
+    logger: (Logger or None)
+
+    Returns
+    ----------
+    pubmed_data: (dict) pmid -> (dates, metadata) for the articles included in
+        the response, or pmid -> None if the article was missing pubmed metadata.
+        PMIDs are absent from the dict if the fetch failed.
+    """
+    pubmed_data = {}
+    if len(pmids) == 0:
+        return pubmed_data
+    #> The articles are parsed as they are streamed
+    try:
+        for pubmed_article in eutils_stream('efetch', {'db': 'pubmed', 'retmode': 'xml', 'id': ','.join(pmids)}, ['PubmedArticle'], method='post'):
+            pmid = pubmed_article.find('MedlineCitation').find('PMID').text
+            try:
+                pubmed_data[pmid] = parse_pubmed_article(pubmed_article, verbosity=verbosity, logger=logger)
+            except (AttributeError, TypeError):
+                pubmed_data[pmid] = None
+    except RuntimeError:
+        if verbosity=='full': logger.info(f"Pubmed batch fetch of {len(pmids)} articles failed after 10 retries")
+    return pubmed_data
+
+
+def create_article(pmid, dates, metadata, journal):
+    """
+    Creates an (unsaved) Article from its dates and metadata
+
+    Parameters
+    ----------
+    pmid: (str)
+    dates: (dict) datetime.datetime objs (or None) for Received, Accepted and Published
+    metadata: (dict) doi, title and authors of the article
+    journal: (Journal or ObjectId)
+
+    Returns
+    ----------
+    article: (Article)
+    """
+    return Article(
+        doi=metadata.get('doi',''),
+        pmid=pmid,
+        title=metadata.get('title',''),
+        first_author=f"{metadata['authors'][0].get('lastname','NoLastname')}, {metadata['authors'][0].get('forename', 'NoForeName')}" if len(metadata.get('authors', []))>0 else '',
+        last_author=f"{metadata['authors'][-1].get('lastname','NoLastname')}, {metadata['authors'][-1].get('forename', 'NoForeName')}" if len(metadata.get('authors', []))>0 else '',
+        first_affiliation=metadata['authors'][0].get('affiliation','NoAffiliation') if len(metadata.get('authors', []))>0 else '',
+        last_affiliation=metadata['authors'][-1].get('affiliation','NoAffiliation') if len(metadata.get('authors', []))>0 else '',
+        received=dates['Received'],
+        accepted=dates['Accepted'],
+        published=dates['Published'],
+        journal=journal
+    )
+
+class ArticleWriter:
+    """
+    Buffers article writes and sends them to the database as unordered
+    bulk upserts keyed on pmid (or doi for articles without pmid). As the
+    writes are upserts, retrying a flush does not duplicate articles.
+    Use as a context manager to flush the remaining writes on exit
+    """
+    def __init__(self, flush_size=BULK_WRITE_SIZE):
+        self.flush_size = flush_size
+        self.operations = []
+        self.n_written = 0
+
+    def add(self, article):
+        """
+        Adds an (unsaved) Article to the buffer
+        """
+        article_doc = article.to_mongo().to_dict()
+        article_doc.pop('_id', None)
+        if article.pmid:
+            article_filter = {'pmid': article.pmid}
+        else:
+            article_filter = {'doi': article.doi}
+        self.operations.append(UpdateOne(article_filter, {'$set': article_doc}, upsert=True))
+        if len(self.operations) >= self.flush_size:
+            self.flush()
+
+    def set_pmid(self, doi, pmid):
+        """
+        Adds the pmid of an existing article, identified by its doi, to the buffer
+        """
+        self.operations.append(UpdateOne({'doi': doi}, {'$set': {'pmid': pmid}}))
+        if len(self.operations) >= self.flush_size:
+            self.flush()
+
+    def flush(self, retries=3):
+        """
+        Sends the buffered writes to the database in a single bulk_write
+        """
+        if not self.operations:
+            return
+        for retry in range(retries):
+            try:
+                with metrics.timed('db_write', 'mongodb') as record:
+                    record['items'] = len(self.operations)
+                    Article._get_collection().bulk_write(self.operations, ordered=False)
+            except AutoReconnect:
+                if retry == retries - 1:
+                    raise
+                time.sleep(1)
+            else:
+                break
+        self.n_written += len(self.operations)
+        self.operations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+def iter_pubmed_data(pmid_pages, prev_pmids, verbosity='full', logger=None):
+    """
+    Iterates over pages of pmids and fetches the PubMed data of the new
+    pmids of each page in batches of EFETCH_BATCH_SIZE
+
+    Parameters
+    ----------
+    pmid_pages: (iterable of list) pages of pmids
+    prev_pmids: (set) pmids already in the database which are not fetched
+
+    Yields
+    ----------
+    pmid: (str)
+    pubmed_data: (dict) output of get_data_pubmed_batch for the batch including pmid
+    """
+    for pmids in pmid_pages:
+        for batch_start in range(0, len(pmids), EFETCH_BATCH_SIZE):
+            batch_pmids = pmids[batch_start:batch_start+EFETCH_BATCH_SIZE]
+            pubmed_data = get_data_pubmed_batch(
+                [pmid for pmid in batch_pmids if pmid not in prev_pmids], 
+                verbosity=verbosity, logger=logger)
+            for pmid in batch_pmids:
+                yield pmid, pubmed_data
 
-def fetch_journal_articles_data(journal_abbr, start_year=0, end_year=None, max_results=10000, verbosity='full', logger=None):
+def fetch_journal_articles_data(journal_abbr, start_year=0, end_year=None, max_results=0, use_history=True, incremental=False, bulk_write_size=BULK_WRITE_SIZE, run=None, verbosity='full', logger=None):
     """
     Uses Pubmed/journal website to get the data of latest articles of a journal based on its abbreviated name
 
@@ -276,118 +729,287 @@ def fetch_journal_articles_data(journal_abbr, start_year=0, end_year=None, max_r
     max_results: (int) number of recent articles to retrieve, 0 will get all the articles
     start_year: (int)
     end_year: (int)
+    use_history: (bool) page through the search results using E-utilities history
+        server (splitting the searches with more than ESEARCH_MAX_RESULTS results by Entrez date)
+        instead of retrieving them in a single request, which is limited to
+        max_results (and 10000 if max_results is 0)
+    incremental: (bool) only search for the articles added to PubMed (Entrez date)
+        since the journal was last checked, and retry the failed articles which are due
+    bulk_write_size: (int) number of article writes buffered before writing them to the database
+    run: (UpdaterRun or None) updater run in which the pmid cursor of the journal is checkpointed
+        every CHECKPOINT_INTERVAL pmids, and from which it is resumed. The search results are 
+        limited to the articles added to PubMed before the run started, to keep the cursor valid
     verbosity: (str or None) 'full' will print all dois, 'summary' prints the counter every 5 articles, None prints nothing
     logger: (Logger or None)
 
     Returns
     ----------
-    articles: (list) a list of entities.Article items
+    n_added: (int) number of articles added to the database
     """
     if not end_year:
         end_year = datetime.date.today().year + 2
-    query = f'"{journal_abbr}"[jour] {start_year}:{end_year}[DP]'
-    search_url = f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pubmed&retmax={max_results}&term={query}'
-    search_succeeded = False
-    retries = 0
-    while (retries < 10) and (not search_succeeded):
-        try:
-            search_res_xml = requests.get(search_url).text
-            search_res_root = ET.fromstring(search_res_xml)
-        except:
-            retries += 1
-            time.sleep(.2)
-        else:
-            search_succeeded = True
-    if not search_succeeded:
-        if verbosity=='full': logger.info("Pubmed search failed after 10 retries")
-        return
     # get journal and publisher
     journal = Journal.objects.get(abbr_name=journal_abbr)
     publisher_Q = Publisher.objects.filter(journals__contains=journal)
     if publisher_Q.count() == 0:
         logger.info("Journal has no publisher")
-        return
+        return 0
     else:
         publisher = publisher_Q[0]
+    query = f'"{journal_abbr}"[jour] {start_year}:{end_year}[DP]'
+    #> Load the articles which failed before, which are skipped until they are due for retry
+    failed_articles = {
+        failed_article['pmid']: failed_article 
+        for failed_article in FailedArticle.objects(journal=journal).only('pmid', 'attempts', 'next_retry_at').as_pymongo()
+    }
+    now = datetime.datetime.now()
+    not_due_pmids = {pmid for pmid, failed_article in failed_articles.items() if failed_article['next_retry_at'] > now}
+    retry_pmids = []
+    date_params = {}
+    if incremental and journal.last_checked:
+        #> The failed articles were added to PubMed before the last check and are not
+        #  found by the search, so the ones due for retry are processed after its results
+        retry_pmids = sorted(set(failed_articles) - not_due_pmids, reverse=True)
+        #> Limit to articles added since last check (with a margin of one day
+        #  as Entrez dates have a resolution of days)
+        mindate = journal.last_checked - datetime.timedelta(days=1)
+        date_params = {'datetype': 'edat', 'mindate': mindate.strftime('%Y/%m/%d'), 'maxdate': '3000'}
+    #> The journal is checked up to the upper bound of the search, so that the 
+    #  articles added to PubMed during a (long or resumed) run are found by the next run
+    checked_at = datetime.datetime.now()
+    if run is not None:
+        date_params = {'datetype': 'edat', 'mindate': '1800/01/01', **date_params, 'maxdate': run.started_at.strftime('%Y/%m/%d')}
+        checked_at = run.started_at
+    if use_history:
+        histories = esearch_histories('pubmed', query, **date_params)
+        if histories is None:
+            if verbosity=='full': logger.info("Pubmed search failed after 10 retries")
+            return 0
+        search_count = sum(history['count'] for history in histories)
+        total_count = min(search_count, max_results) if max_results else search_count
+        cursor = get_pmid_cursor(run, journal, total_count, verbosity=verbosity, logger=logger)
+        pmid_pages = iter_esearch_histories_ids('pubmed', histories, max_results=max_results, start=cursor)
+    else:
+        try:
+            pmids = [element.text for element in eutils_stream('esearch', {'db': 'pubmed', 'retmax': max_results or 10000, 'term': query, **date_params}, ['Id'])]
+        except RuntimeError:
+            if verbosity=='full': logger.info("Pubmed search failed after 10 retries")
+            return 0
+        total_count = len(pmids)
+        cursor = get_pmid_cursor(run, journal, total_count, verbosity=verbosity, logger=logger)
+        pmid_pages = [pmids[cursor:]]
     # get data of all pmids
-    pmids = [element.text for element in list(search_res_root.find('IdList'))]
-    if len(pmids) == 0:
+    if total_count + len(retry_pmids) == 0:
         if verbosity=='full': logger.info(f"No articles found in {start_year}:{end_year}")
-        return
+        if date_params:
+            journal.update(set__last_checked=checked_at)
+        return 0
+    #> The cursor only covers the search results, the retried articles are
+    #  skipped on resume as they are no longer due (or were added)
+    pmid_pages = itertools.chain(pmid_pages, [retry_pmids])
+    n_pmids = total_count + len(retry_pmids)
+    # only load the ids of previous articles for lookup
     prev_articles = Article.objects.filter(journal=journal)
-    prev_pmids = [a.pmid for a in prev_articles]
-    prev_dois = [a.doi for a in prev_articles]
-    if '' in prev_dois:
-        prev_dois.remove('')
-    counter = 0
+    prev_pmids = set(prev_articles.scalar('pmid'))
+    prev_dois = set(prev_articles.scalar('doi'))
+    prev_dois.discard('')
+    recovered_pmids = []
+    counter = cursor
     failed = 0
-    total_count = len(pmids)
-    any_success = False
-    for pmid in pmids:
-        article_str = f'[{journal.abbr_name}] ({counter} of {total_count}): {pmid}'
-        if pmid in prev_pmids:
-            if verbosity=='full': logger.info(f'{article_str} already in db')
-            counter+=1
-            any_success = True
-            continue
-        start = time.time()
-        # first try pubmed, then journal
-        where = 'pubmed'
-        try:
-            dates, metadata = get_data_pubmed(pmid, verbosity=verbosity, logger=logger)
-        except AttributeError or TypeError:
-            if verbosity=='full': logger.info(f'{article_str} missing pubmed metadata')
-            counter+=1
-            continue
-        # now we have the doi and can skip the article based on doi
-        # (as some articles only have doi and no pmid)
-        if (metadata.get('doi','') in prev_dois):
-            if verbosity=='full': logger.info(f'{article_str} already in db')
+    n_checked = 0
+    n_added = 0
+    #> The journal was not given up before the interruption, or only failed articles are retried
+    any_success = (cursor > 0) or (total_count == 0)
+    # new articles are written to db in bulk
+    with ArticleWriter(flush_size=bulk_write_size) as article_writer:
+        # pubmed data of new pmids is fetched in batches of EFETCH_BATCH_SIZE
+        for pmid, pubmed_data in iter_pubmed_data(pmid_pages, prev_pmids | not_due_pmids, verbosity=verbosity, logger=logger):
+            if (run is not None) and (cursor < counter <= total_count) and (counter % CHECKPOINT_INTERVAL == 0):
+                #> Write the processed articles before moving the cursor past them
+                article_writer.flush()
+                set_pmid_cursor(run, journal, counter, total_count)
+            article_str = f'[{journal.abbr_name}] ({counter} of {n_pmids}): {pmid}'
+            if pmid in prev_pmids:
+                if verbosity=='full': logger.info(f'{article_str} already in db')
+                counter+=1
+                any_success = True
+                continue
+            if pmid in not_due_pmids:
+                if verbosity=='full': logger.info(f'{article_str} failed before, retry not due')
+                counter+=1
+                continue
+            n_checked += 1
+            start = time.time()
+            # first try pubmed, then journal
+            where = 'pubmed'
+            try:
+                if pmid in pubmed_data:
+                    if pubmed_data[pmid] is None:
+                        raise AttributeError("Missing pubmed metadata")
+                    dates, metadata = pubmed_data[pmid]
+                else:
+                    #> Fall back to individual fetch if the article was not
+                    #  included in the batch response
+                    dates, metadata = get_data_pubmed(pmid, verbosity=verbosity, logger=logger)
+            except RuntimeError:
+                #> Not recorded as failed, as PubMed could not be reached
+                if verbosity=='full': logger.info(f'{article_str} pubmed fetch failed')
+                counter+=1
+                continue
+            except PubmedArticleNotFound:
+                if verbosity=='full': logger.info(f'{article_str} not in pubmed')
+                record_failed_article(pmid, journal, publisher.domain, 'not_in_pubmed', failed_articles.get(pmid))
+                not_due_pmids.add(pmid)
+                counter+=1
+                continue
+            except (AttributeError, TypeError):
+                if verbosity=='full': logger.info(f'{article_str} missing pubmed metadata')
+                record_failed_article(pmid, journal, publisher.domain, 'missing_pubmed_metadata', failed_articles.get(pmid))
+                not_due_pmids.add(pmid)
+                counter+=1
+                continue
+            # now we have the doi and can skip the article based on doi
+            # (as some articles only have doi and no pmid)
+            if (metadata.get('doi','') in prev_dois):
+                if verbosity=='full': logger.info(f'{article_str} already in db')
+                counter+=1
+                # add pmid
+                article_writer.set_pmid(metadata['doi'], pmid)
+                prev_pmids.add(pmid)
+                if pmid in failed_articles:
+                    recovered_pmids.append(pmid)
+                continue
+            # if pubmed has no dates data, try journal
+            failure_reason = 'no_dates'
+            if not ((dates['Received'] is not None) & any([v is not None for v in ['Accepted', 'Published']])):
+                where = 'journal'
+                if 'doi' in metadata:
+                    try:
+                        dates = scraper.get_dates(metadata['doi'], publisher.domain, logger=logger)
+                    except scraper.PageFetchError as e:
+                        #> Retried soon as the page may have dates
+                        if verbosity=='full': logger.info(f'{article_str} {e}')
+                        failure_reason = 'page_fetch_failed'
+            elapsed = time.time() - start
+            # if either pubmed or journal has dates data, add the article to db
+            if (dates['Received'] is not None) & any([v is not None for v in ['Accepted', 'Published']]):
+                article_writer.add(create_article(pmid, dates, metadata, journal))
+                prev_pmids.add(pmid)
+                if pmid in failed_articles:
+                    recovered_pmids.append(pmid)
+                n_added += 1
+                any_success = True
+                if verbosity=='full': logger.info(f'{article_str} (using {where} in {elapsed:.2f}s)')
+            else:
+                if verbosity=='full': logger.info(f'{article_str} failed')
+                record_failed_article(pmid, journal, publisher.domain, failure_reason, failed_articles.get(pmid), doi=metadata.get('doi',''))
+                not_due_pmids.add(pmid)
+                failed += 1
+                if (failed >= GIVE_UP_LIMIT) and (not any_success):
+                    if verbosity=='full': logger.info(f"No success for any of the {GIVE_UP_LIMIT} articles searched")
+                    journal.update(set__last_failed=True, inc__n_articles_checked=n_checked)
+                    return 0
             counter+=1
-            # add pmid
-            article = Article.objects.filter(doi=metadata['doi'])[0]
-            article.pmid = pmid
-            article.save()
-            continue
-        # if pubmed has no dates data, try journal
-        if not ((dates['Received'] is not None) & any([v is not None for v in ['Accepted', 'Published']])):
-            where = 'journal'
-            if 'doi' in metadata:
-                dates = scraper.get_dates(metadata['doi'], publisher.domain, logger=logger)
-        elapsed = time.time() - start
-        # if either pubmed or journal has dates data, add the article to db
-        if (dates['Received'] is not None) & any([v is not None for v in ['Accepted', 'Published']]):
-            article = Article(
-                doi=metadata.get('doi',''),
-                pmid=pmid,
-                title=metadata.get('title',''),
-                first_author=f"{metadata['authors'][0].get('lastname','NoLastname')}, {metadata['authors'][0].get('forename', 'NoForeName')}" if len(metadata.get('authors', []))>0 else '',
-                last_author=f"{metadata['authors'][-1].get('lastname','NoLastname')}, {metadata['authors'][-1].get('forename', 'NoForeName')}" if len(metadata.get('authors', []))>0 else '',
-                first_affiliation=metadata['authors'][0].get('affiliation','NoAffiliation') if len(metadata.get('authors', []))>0 else '',
-                last_affiliation=metadata['authors'][-1].get('affiliation','NoAffiliation') if len(metadata.get('authors', []))>0 else '',
-                received=dates['Received'],
-                accepted=dates['Accepted'],
-                published=dates['Published'],
-                journal=journal
-            )
-            article.save()
-            any_success = True
-            if verbosity=='full': logger.info(f'{article_str} (using {where} in {elapsed:.2f}s)')
-        else:
-            if verbosity=='full': logger.info(f'{article_str} failed')
-            failed += 1
-            if (failed >= GIVE_UP_LIMIT) and (not any_success):
-                if verbosity=='full': logger.info(f"No success for any of the {GIVE_UP_LIMIT} articles searched")
-                journal.update(set__last_failed=True)
-                return
-        counter+=1
-        if (counter%5==0) and (verbosity=='summary'):
-            logger.info(counter)
+            if (counter%5==0) and (verbosity=='summary'):
+                logger.info(counter)
+    journal.update(inc__n_articles_checked=n_checked, inc__n_articles_added=n_added)
+    if recovered_pmids:
+        FailedArticle.objects(pmid__in=recovered_pmids).delete()
     if any_success:
         journal.last_failed = False
-        journal.last_checked = datetime.datetime.now()
+        journal.last_checked = checked_at
         journal.save()
-        
+        # materialize the statistics shown by the app
+        stats.update_journal_stats(journal)
+    return n_added
+
+
+def record_failed_article(pmid, journal, publisher_domain, reason, failed_article=None, doi=''):
+    """
+    Records an article whose dates could not be extracted in FailedArticle, 
+    and schedules its next retry with exponential backoff (or after the fixed
+    interval of FAILED_FIXED_RETRY_INTERVALS)
+
+    Parameters
+    ----------
+    pmid: (str)
+    journal: (Journal)
+    publisher_domain: (str)
+    reason: (str) 'missing_pubmed_metadata', 'not_in_pubmed', 'page_fetch_failed' or 'no_dates'
+    failed_article: (dict or None) the previous record of the article with 'attempts'
+    doi: (str)
+    """
+    attempts = failed_article['attempts'] if failed_article else 0
+    if reason not in FAILED_TRANSIENT_REASONS:
+        attempts += 1
+    if reason in FAILED_FIXED_RETRY_INTERVALS:
+        retry_interval = FAILED_FIXED_RETRY_INTERVALS[reason]
+    else:
+        retry_interval = min(FAILED_RETRY_INTERVAL * 2 ** (attempts - 1), FAILED_RETRY_MAX_INTERVAL)
+    now = datetime.datetime.now()
+    FailedArticle.objects(pmid=pmid).update_one(
+        upsert=True,
+        set__doi=doi,
+        set__journal=journal,
+        set__publisher_domain=publisher_domain,
+        set__reason=reason,
+        set__attempts=attempts,
+        set__failed_at=now,
+        set__next_retry_at=now + datetime.timedelta(days=retry_interval))
+
+def clear_failed_articles(publisher_domain=None, journal=None):
+    """
+    Clears the failed articles (of a publisher and/or journal) so that they 
+    are retried in the next update, e.g. after scraper gained support for the publisher
+
+    Parameters
+    ----------
+    publisher_domain: (str or None)
+    journal: (Journal or None)
+
+    Returns
+    ----------
+    n_cleared: (int)
+    """
+    failed_articles = FailedArticle.objects
+    if publisher_domain:
+        failed_articles = failed_articles.filter(publisher_domain=publisher_domain)
+    if journal:
+        failed_articles = failed_articles.filter(journal=journal)
+    return failed_articles.delete()
+
+def get_pmid_cursor(run, journal, total_count, verbosity='full', logger=None):
+    """
+    Gets the number of pmids of the journal processed in an interrupted run.
+    The cursor is only valid if the search has the same number of results
+
+    Parameters
+    ----------
+    run: (UpdaterRun or None)
+    journal: (Journal)
+    total_count: (int) number of search results
+
+    Returns
+    ----------
+    cursor: (int) index of the first pmid to process, 0 if there is no valid cursor
+    """
+    if run is None:
+        return 0
+    pmid_cursor = run.pmid_cursors.get(str(journal.id))
+    if pmid_cursor is None:
+        return 0
+    if pmid_cursor['count'] != total_count:
+        if verbosity=='full': logger.info(f"[{journal.abbr_name}] search results changed since the checkpoint, starting over")
+        return 0
+    if verbosity=='full': logger.info(f"[{journal.abbr_name}] resuming from pmid {pmid_cursor['cursor']} of {total_count}")
+    return pmid_cursor['cursor']
+
+def set_pmid_cursor(run, journal, cursor, total_count):
+    """
+    Checkpoints the number of processed pmids of the journal in the run
+    """
+    UpdaterRun.objects(id=run.id).update_one(**{
+        f'set__pmid_cursors__{journal.id}': {'cursor': cursor, 'count': total_count}})
 
 def sort_publishers_by_journals_count():
     pipeline = [
@@ -0,0 +1,124 @@
+"""
+Normalization of the date strings scraped from publisher pages and of the
+PubMed date elements to datetime objs, using precomputed month name tables
+instead of datetime.strptime, and memoized as the same dates are repeated
+across the articles of a journal
+"""
+import datetime
+import functools
+
+DATE_CACHE_SIZE = 16384 # number of memoized date strings
+
+#> Full and abbreviated month names, including the variants of the
+#  non-English (es, pt, fr, de, it) pages of some publishers (e.g. scielo)
+MONTH_NAMES = {
+    1: ['january', 'jan', 'enero', 'ene', 'janeiro', 'janvier', 'janv', 'januar', 'gennaio', 'gen'],
+    2: ['february', 'feb', 'febrero', 'fevereiro', 'fev', 'février', 'févr', 'fevrier', 'fevr', 'februar', 'febbraio'],
+    3: ['march', 'mar', 'marzo', 'março', 'marco', 'mars', 'märz', 'marz', 'mär'],
+    4: ['april', 'apr', 'abril', 'abr', 'avril', 'avr', 'aprile'],
+    5: ['may', 'mayo', 'maio', 'mai', 'maggio', 'mag'],
+    6: ['june', 'jun', 'junio', 'junho', 'juin', 'juni', 'giugno', 'giu'],
+    7: ['july', 'jul', 'julio', 'julho', 'juillet', 'juil', 'juli', 'luglio', 'lug'],
+    8: ['august', 'aug', 'agosto', 'ago', 'août', 'aout', 'aoû'],
+    9: ['september', 'sep', 'sept', 'septiembre', 'setembro', 'set', 'septembre', 'settembre'],
+    10: ['october', 'oct', 'octubre', 'outubro', 'out', 'octobre', 'oktober', 'okt', 'ottobre', 'ott'],
+    11: ['november', 'nov', 'noviembre', 'novembro', 'novembre'],
+    12: ['december', 'dec', 'diciembre', 'dic', 'dezembro', 'dez', 'décembre', 'decembre', 'déc', 'dezember', 'dicembre'],
+}
+MONTHS = {name: month for month, names in MONTH_NAMES.items() for name in names}
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def month_name_to_number(month_str):
+    """
+    Converts a (full or abbreviated) month name to the month number,
+    ignoring the case and trailing dots, e.g. 'Sept.' -> 9
+
+    Parameters
+    ----------
+    month_str: (str)
+
+    Returns
+    ----------
+    month: (int)
+
+    Raises
+    ----------
+    ValueError if the month is not recognized
+    """
+    month = MONTHS.get(month_str.strip().rstrip('.,').lower())
+    if month is None:
+        raise ValueError(f"Unknown month {month_str}")
+    return month
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def month_to_number(month_str):
+    """
+    Converts a month number or (full or abbreviated) month name to the month number
+
+    Raises
+    ----------
+    ValueError if the month is not recognized
+    """
+    if month_str.strip().isdigit():
+        month = int(month_str)
+        if not 1 <= month <= 12:
+            raise ValueError(f"Unknown month {month_str}")
+        return month
+    return month_name_to_number(month_str)
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def datestr_tuple_to_ymd(datestr_tuple, pattern):
+    """
+    Converts a tuple of date strings and their pattern to (year, month, day)
+
+    Parameters
+    ----------
+    datestr_tuple: (tuple of str) e.g. ('July', '13', '2020')
+    pattern: (str) the order of the date strings, using the strptime codes
+        B (full month name), b (abbreviated month name), m (month number), d and Y,
+        e.g. 'BdY'. Month names are accepted both in full and abbreviated forms
+
+    Returns
+    ----------
+    ymd: (tuple of int)
+    """
+    for datestr, code in zip(datestr_tuple, pattern):
+        if code in 'Bb':
+            month = month_name_to_number(datestr)
+        elif code == 'm':
+            month = int(datestr)
+        elif code == 'd':
+            day = int(datestr)
+        elif code == 'Y':
+            year = int(datestr)
+    #> Validate the date
+    datetime.date(year, month, day)
+    return year, month, day
+
+def datestr_tuple_to_datetime(datestr_tuple, pattern):
+    """
+    Converts a tuple of date strings and their pattern to datetime obj
+    (see datestr_tuple_to_ymd)
+    """
+    return datetime.datetime(*datestr_tuple_to_ymd(tuple(datestr_tuple), pattern))
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def ymd_strs_to_datetime(year_str, month_str, day_str):
+    """
+    Converts the year, month and day strings of a date to datetime obj
+    """
+    return datetime.datetime(int(year_str), month_to_number(month_str), int(day_str))
+
+def pubmed_date_to_datetime(date_element):
+    """
+    Converts a pubmed date element to datetime obj. Its first children
+    are Year, Month and Day (in this order, as in the PubMed DTD)
+    """
+    try:
+        year, month, day = date_element[:3]
+    except ValueError:
+        raise AttributeError("Incomplete pubmed date")
+    if (year.tag != 'Year') or (month.tag != 'Month') or (day.tag != 'Day'):
+        raise AttributeError("Incomplete pubmed date")
+    return ymd_strs_to_datetime(year.text, month.text, day.text)
@@ -1,31 +1,39 @@
-import datetime
+import xml.etree.ElementTree as ET
 import requests
 
-def datestr_tuple_to_datetime(datestr_tuple, pattern):
+def iterparse_elements(chunks, tags):
     """
-    Converts a tuple of date strings and their pattern to datetime obj
-    """
-    for datestr_idx in range(3):
-        if pattern[datestr_idx] == 'B': # Month name full
-            month = datetime.datetime.strptime(datestr_tuple[datestr_idx], '%B').month
-        elif pattern[datestr_idx] == 'b': # Month name short
-            month = datetime.datetime.strptime(datestr_tuple[datestr_idx], '%b').month
-        elif pattern[datestr_idx] == 'm':
-            month = int(datestr_tuple[datestr_idx])
-        elif pattern[datestr_idx] == 'd':
-            day = int(datestr_tuple[datestr_idx])
-        elif pattern[datestr_idx] == 'Y':
-            year = int(datestr_tuple[datestr_idx])
-    return datetime.datetime(year, month, day)
+    Parses XML incrementally from chunks and yields the elements with
+    the given tags as soon as they are complete. Each yielded element is
+    removed from its parent once it is processed, so that the memory
+    used does not grow with the size of the XML
 
-def pubmed_date_to_datetime(date_element):
-    """
-    Converts a pubmed date element to datetime obj
+    Parameters
+    ----------
+    chunks: (iterable of bytes) e.g. response.iter_content() or chunks of a file
+    tags: (list of str) e.g. ['PubmedArticle']
+
+    Yields
+    ----------
+    element: (xml.etree.ElementTree.Element)
     """
-    year = int(date_element.find('Year').text)
-    month = int(date_element.find('Month').text)
-    day = int(date_element.find('Day').text)
-    return datetime.datetime(year, month, day)
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    parents = []
+    def read_events():
+        for event, element in parser.read_events():
+            if event == 'start':
+                parents.append(element)
+                continue
+            parents.pop()
+            if element.tag in tags:
+                yield element
+                if parents:
+                    parents[-1].remove(element)
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from read_events()
+    parser.close()
+    yield from read_events()
 
 def download_file(url, filename=None):
     """
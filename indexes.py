@@ -0,0 +1,129 @@
+"""
+Creates and verifies the indexes declared in the meta of models.py documents,
+and reports the query plans of the frequent queries of the app and updater
+
+Usage: python indexes.py {create,verify,report} [journal_abbr]
+"""
+import sys, datetime
+
+from models import *
+
+INDEXED_MODELS = [Article, Journal, BroadSubjectTerm, Publisher, DOIResolution, JournalStats, UpdaterRun, FailedArticle]
+
+def get_missing_indexes():
+    """
+    Compares the declared indexes of INDEXED_MODELS with the indexes in the database
+
+    Returns
+    ----------
+    missing_indexes: (dict) model name -> list of declared index keys which do not exist
+    """
+    missing_indexes = {}
+    for model in INDEXED_MODELS:
+        existing_keys = [
+            tuple(index['key']) 
+            for index in model._get_collection().index_information().values()]
+        for index_key in model.list_indexes():
+            #> The _id index is created with the collection (e.g. on the first UpdaterRun)
+            if (tuple(index_key) not in existing_keys) and (index_key != [('_id', 1)]):
+                missing_indexes.setdefault(model.__name__, []).append(index_key)
+    return missing_indexes
+
+def verify_indexes():
+    """
+    Prints the declared indexes which are missing in the database
+
+    Returns
+    ----------
+    (bool) whether all the declared indexes exist
+    """
+    missing_indexes = get_missing_indexes()
+    for model_name, index_keys in missing_indexes.items():
+        for index_key in index_keys:
+            print(f"{model_name}: missing index {index_key}")
+    if not missing_indexes:
+        print("All declared indexes exist")
+    return not missing_indexes
+
+def create_indexes(journal_abbr=None):
+    """
+    Creates the declared indexes (existing indexes are left as is) and
+    reports the query plans before and after
+    """
+    if not WRITING_ALLOWED:
+        print("Writing to db not allowed on this machine")
+        return
+    print("Query plans before:")
+    report_query_plans(journal_abbr)
+    for model in INDEXED_MODELS:
+        model.ensure_indexes()
+    verify_indexes()
+    print("Query plans after:")
+    report_query_plans(journal_abbr)
+
+def get_plan_stages(plan):
+    """
+    Returns the stages of a (winning) query plan from top to bottom, e.g. ['FETCH', 'IXSCAN']
+    """
+    stages = [plan['stage']]
+    if 'inputStage' in plan:
+        stages += get_plan_stages(plan['inputStage'])
+    for input_stage in plan.get('inputStages', []):
+        stages += get_plan_stages(input_stage)
+    return stages
+
+def report_query_plans(journal_abbr=None):
+    """
+    Prints the winning plan and examined documents/keys of the frequent queries
+
+    Parameters
+    ----------
+    journal_abbr: (str or None) journal used in the queries, by default the first journal
+    """
+    if journal_abbr:
+        journal = Journal.objects.get(abbr_name=journal_abbr)
+    else:
+        journal = Journal.objects.first()
+    if journal is None:
+        print("No journals in the database")
+        return
+    article = Article.objects.filter(journal=journal).first() or Article()
+    queries = {
+        'Article by journal': Article.objects.filter(journal=journal),
+        'Article by journal and published': Article.objects.filter(journal=journal, published__gte=datetime.datetime(2020, 1, 1)).order_by('published'),
+        'Article by pmid': Article.objects.filter(pmid=article.pmid),
+        'Article by doi': Article.objects.filter(doi=article.doi),
+        'Journal by abbr_name': Journal.objects.filter(abbr_name=journal.abbr_name),
+        'Publisher by journal': Publisher.objects.filter(journals__contains=journal),
+        'JournalStats by abbr_name': JournalStats.objects.filter(abbr_name=journal.abbr_name),
+    }
+    for query_name, queryset in queries.items():
+        explain = queryset.explain()
+        print_query_plan(query_name, explain)
+    #> distinct is not a cursor and is explained using the explain command
+    article_collection = Article._get_collection()
+    explain = article_collection.database.command(
+        'explain', {'distinct': article_collection.name, 'key': 'journal', 'query': {}}, 
+        verbosity='executionStats')
+    print_query_plan('Article distinct journal', explain)
+
+def print_query_plan(query_name, explain):
+    """
+    Prints the winning plan stages and execution stats of an explain output
+    """
+    stages = get_plan_stages(explain['queryPlanner']['winningPlan'])
+    execution_stats = explain.get('executionStats', {})
+    print(f"{query_name}: {' <- '.join(stages)}, "
+          f"docs examined: {execution_stats.get('totalDocsExamined', 'NA')}, "
+          f"keys examined: {execution_stats.get('totalKeysExamined', 'NA')}")
+
+COMMANDS = {
+    'create': create_indexes,
+    'verify': lambda journal_abbr=None: verify_indexes(),
+    'report': report_query_plans,
+}
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'verify'
+    journal_abbr = sys.argv[2] if len(sys.argv) > 2 else None
+    COMMANDS[command](journal_abbr)
@@ -0,0 +1,178 @@
+"""
+In-memory search index of journals used by the app's journal autocomplete.
+Queries are matched against the prefixes of abbreviations, full names, their
+words and ISSNs using a trie, and against any substring of abbreviations and
+full names using a trigram index
+"""
+import re
+
+MAX_RESULTS = 50
+NGRAM_SIZE = 3
+MAX_PREFIX_LENGTH = 12 # longer keys are truncated in the trie and longer queries are matched by n-grams
+#> Match tiers used for ranking (lower is better)
+TIER_EXACT = 0
+TIER_ABBR_PREFIX = 1
+TIER_ISSN_PREFIX = 2
+TIER_FULL_NAME_PREFIX = 3
+TIER_WORD_PREFIX = 4
+TIER_SUBSTRING = 5
+
+
+def normalize(text):
+    """
+    Normalizes journal names, ISSNs and queries by lowering the case
+    and removing punctuation (e.g. "J. Neurosci." -> "j neurosci",
+    "0270-6474" -> "02706474")
+    """
+    text = re.sub(r'[-.]', '', text.lower())
+    return ' '.join(re.sub(r'[^a-z0-9]', ' ', text).split())
+
+def get_ngrams(text, n=NGRAM_SIZE):
+    """
+    Gets the set of character n-grams of text
+    """
+    return {text[i:i+n] for i in range(len(text) - n + 1)}
+
+class JournalSearchIndex:
+    """
+    Prebuilt search index over abbr_name, full_name and issns of journals
+
+    Parameters
+    ----------
+    journals: (iterable) of (dict) with 'abbr_name' and optionally
+        'full_name' and 'issns', e.g. from Journal.objects.as_pymongo()
+    """
+    def __init__(self, journals):
+        self.journals = []
+        self.abbr_names = []
+        self.search_texts = []
+        self.trie = {} # prefixes of abbreviations, full names and ISSNs
+        self.word_trie = {} # prefixes of the words of names
+        self.ngrams = {}
+        for journal_idx, journal in enumerate(journals):
+            abbr_name = normalize(journal['abbr_name'])
+            full_name = normalize(journal.get('full_name') or '')
+            self.journals.append(journal)
+            self.abbr_names.append(journal['abbr_name'])
+            self.search_texts.append((abbr_name, full_name))
+            #> Add the prefixes of names and ISSNs, and of the words of names to the tries
+            self._add_to_trie(self.trie, abbr_name, journal_idx, TIER_ABBR_PREFIX)
+            self._add_to_trie(self.trie, full_name, journal_idx, TIER_FULL_NAME_PREFIX)
+            for issn in journal.get('issns') or []:
+                self._add_to_trie(self.trie, normalize(issn), journal_idx, TIER_ISSN_PREFIX)
+            for word in set(abbr_name.split()[1:] + full_name.split()[1:]):
+                self._add_to_trie(self.word_trie, word, journal_idx, TIER_WORD_PREFIX)
+            #> Add the n-grams of names to the inverted index
+            for ngram in get_ngrams(abbr_name) | get_ngrams(full_name):
+                self.ngrams.setdefault(ngram, []).append(journal_idx)
+
+    def __len__(self):
+        return len(self.abbr_names)
+
+    def _add_to_trie(self, trie, key, journal_idx, tier):
+        """
+        Adds the first MAX_PREFIX_LENGTH characters of key to the trie with the 
+        journal and its match tier stored at the node of its last character (under '')
+        """
+        if not key:
+            return
+        node = trie
+        for char in key[:MAX_PREFIX_LENGTH]:
+            node = node.setdefault(char, {})
+        node.setdefault('', []).append((journal_idx, tier))
+
+    def _search_trie(self, trie, query, max_matches=None):
+        """
+        Finds the journals with a key starting with query, visiting shorter keys 
+        first and stopping after max_matches journals (None finds all)
+
+        Returns
+        ----------
+        matches: (dict) journal_idx -> best tier, TIER_EXACT for the names and
+            ISSNs equal to query
+        """
+        node = trie
+        for char in query:
+            node = node.get(char)
+            if node is None:
+                return {}
+        matches = {}
+        #> Keys ending at the node are exact matches unless they are truncated
+        level = [(node, len(query) < MAX_PREFIX_LENGTH)]
+        while level and ((max_matches is None) or (len(matches) < max_matches)):
+            next_level = []
+            for node, is_exact in level:
+                for child_char, child in node.items():
+                    if child_char == '':
+                        for journal_idx, tier in child:
+                            tier = TIER_EXACT if (is_exact and tier != TIER_WORD_PREFIX) else tier
+                            matches[journal_idx] = min(tier, matches.get(journal_idx, tier))
+                    else:
+                        next_level.append((child, False))
+            level = next_level
+        return matches
+
+    def _search_ngrams(self, query):
+        """
+        Finds the journals containing query in their abbreviation or full name
+
+        Returns
+        ----------
+        matches: (dict) journal_idx -> tier
+        """
+        postings = [self.ngrams.get(ngram, []) for ngram in get_ngrams(query)]
+        if not postings:
+            return {}
+        postings.sort(key=len)
+        candidates = set(postings[0]).intersection(*postings[1:])
+        matches = {}
+        for journal_idx in candidates:
+            abbr_name, full_name = self.search_texts[journal_idx]
+            if query in (abbr_name, full_name):
+                matches[journal_idx] = TIER_EXACT
+            elif abbr_name.startswith(query):
+                matches[journal_idx] = TIER_ABBR_PREFIX
+            elif full_name.startswith(query):
+                matches[journal_idx] = TIER_FULL_NAME_PREFIX
+            elif (f' {query}' in f' {abbr_name}') or (f' {query}' in f' {full_name}'):
+                matches[journal_idx] = TIER_WORD_PREFIX
+            elif (query in abbr_name) or (query in full_name):
+                matches[journal_idx] = TIER_SUBSTRING
+        return matches
+
+    def search(self, query, max_results=MAX_RESULTS):
+        """
+        Searches the journals matching query, ranked by match tier
+        (exact, abbreviation prefix, ISSN prefix, full name prefix, word prefix
+        and substring) and then by the length of abbreviation
+
+        Parameters
+        ----------
+        query: (str)
+        max_results: (int)
+
+        Returns
+        ----------
+        journals: (list) of (dict) matched journals
+        """
+        query = normalize(query)
+        if not query:
+            return []
+        if len(query) > MAX_PREFIX_LENGTH:
+            matches = self._search_ngrams(query)
+        else:
+            #> All the name and ISSN prefix matches are ranked, and the word prefix matches
+            #  (which are ranked after them) only fill the remaining results. Extra word
+            #  matches are collected as a shorter word is not necessarily a better match
+            matches = self._search_trie(self.trie, query)
+            if len(matches) < max_results:
+                for journal_idx, tier in self._search_trie(self.word_trie, query, max_results * 4).items():
+                    matches[journal_idx] = min(tier, matches.get(journal_idx, tier))
+            if (len(matches) < max_results) and (len(query) >= NGRAM_SIZE):
+                for journal_idx, tier in self._search_ngrams(query).items():
+                    matches.setdefault(journal_idx, tier)
+        ranked = sorted(matches, key=lambda journal_idx: (
+            matches[journal_idx],
+            len(self.abbr_names[journal_idx]),
+            self.abbr_names[journal_idx]))
+        return [self.journals[journal_idx] for journal_idx in ranked[:max_results]]
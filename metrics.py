@@ -0,0 +1,171 @@
+"""
+Timing and throughput metrics of the ingestion stages (esearch, efetch,
+DOI resolve, page fetch, parse and DB write) per domain, which are collected
+by all threads of the updater and written to METRICS_PATH in Prometheus text
+format and to METRICS_JSON_PATH as JSON
+"""
+import os, time, json, threading, contextlib
+
+METRICS_PATH = 'updater_metrics.prom'
+METRICS_JSON_PATH = 'updater_metrics.json'
+HISTOGRAM_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # seconds
+
+
+class StageMetrics:
+    """
+    Counts, errors, bytes, items, wall and CPU time, and the histogram of
+    wall time of a stage in a domain
+    """
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.items = 0
+        self.seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.bucket_counts = [0] * len(HISTOGRAM_BUCKETS)
+
+    def observe(self, seconds, cpu_seconds=0.0, nbytes=0, items=0, error=False):
+        self.count += 1
+        self.errors += int(error)
+        self.bytes += nbytes
+        self.items += items
+        self.seconds += seconds
+        self.cpu_seconds += cpu_seconds
+        for bucket_idx, upper_bound in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= upper_bound:
+                self.bucket_counts[bucket_idx] += 1
+                break
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'error_rate': self.errors / self.count if self.count else 0,
+            'bytes': self.bytes,
+            'items': self.items,
+            'seconds': self.seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'mean_seconds': self.seconds / self.count if self.count else 0,
+            'histogram': dict(zip([str(upper_bound) for upper_bound in HISTOGRAM_BUCKETS], self.bucket_counts)),
+        }
+
+METRICS = {} # (stage, domain) -> StageMetrics
+METRICS_LOCK = threading.Lock()
+WRITE_LOCK = threading.Lock()
+STARTED_AT = time.time()
+
+def observe(stage, domain='', seconds=0.0, cpu_seconds=0.0, nbytes=0, items=0, error=False):
+    """
+    Records an observation of a stage in a domain
+
+    Parameters
+    ----------
+    stage: (str) e.g. 'efetch' or 'page_fetch'
+    domain: (str) e.g. 'ncbi' or the publisher domain
+    seconds: (float) wall time
+    cpu_seconds: (float) CPU time of the thread
+    nbytes: (int) bytes received
+    items: (int) number of items processed, e.g. articles written
+    error: (bool)
+    """
+    with METRICS_LOCK:
+        if (stage, domain) not in METRICS:
+            METRICS[(stage, domain)] = StageMetrics()
+        METRICS[(stage, domain)].observe(seconds, cpu_seconds, nbytes, items, error)
+
+@contextlib.contextmanager
+def timed(stage, domain=''):
+    """
+    Times the wall and CPU time of the enclosed block as a stage in a domain.
+    The block is counted as an error if it raises an exception
+
+    Yields
+    ----------
+    record: (dict) in which the block can set 'bytes', 'items' and 'error'
+    """
+    record = {'bytes': 0, 'items': 0, 'error': False}
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        yield record
+    except:
+        record['error'] = True
+        raise
+    finally:
+        observe(
+            stage, domain,
+            time.perf_counter() - start, time.thread_time() - cpu_start,
+            record['bytes'], record['items'], record['error'])
+
+def reset_metrics():
+    """
+    Clears the metrics, e.g. at the start of an updater run
+    """
+    global STARTED_AT
+    with METRICS_LOCK:
+        METRICS.clear()
+        STARTED_AT = time.time()
+
+def get_metrics():
+    """
+    Gets a snapshot of the metrics
+
+    Returns
+    ----------
+    metrics: (dict) with 'started_at', 'elapsed_seconds' and 'stages', a list
+        of stage metrics (see StageMetrics.to_dict) with 'stage' and 'domain'
+    """
+    with METRICS_LOCK:
+        stages = [
+            {'stage': stage, 'domain': domain, **stage_metrics.to_dict()}
+            for (stage, domain), stage_metrics in sorted(METRICS.items())
+        ]
+    return {'started_at': STARTED_AT, 'elapsed_seconds': time.time() - STARTED_AT, 'stages': stages}
+
+def to_prometheus(metrics):
+    """
+    Formats the output of get_metrics in Prometheus text format
+
+    Returns
+    ----------
+    text: (str)
+    """
+    lines = [
+        '# HELP review_speed_stage_seconds Wall time of the ingestion stages',
+        '# TYPE review_speed_stage_seconds histogram',
+    ]
+    for stage_metrics in metrics['stages']:
+        labels = f'stage="{stage_metrics["stage"]}",domain="{stage_metrics["domain"]}"'
+        cumulative_count = 0
+        for upper_bound, bucket_count in stage_metrics['histogram'].items():
+            cumulative_count += bucket_count
+            lines.append(f'review_speed_stage_seconds_bucket{{{labels},le="{upper_bound}"}} {cumulative_count}')
+        lines.append(f'review_speed_stage_seconds_bucket{{{labels},le="+Inf"}} {stage_metrics["count"]}')
+        lines.append(f'review_speed_stage_seconds_sum{{{labels}}} {stage_metrics["seconds"]}')
+        lines.append(f'review_speed_stage_seconds_count{{{labels}}} {stage_metrics["count"]}')
+    for name, key, description in [
+            ('errors_total', 'errors', 'Failed calls of the ingestion stages'),
+            ('bytes_total', 'bytes', 'Bytes received by the ingestion stages'),
+            ('items_total', 'items', 'Items processed by the ingestion stages'),
+            ('cpu_seconds_total', 'cpu_seconds', 'CPU time of the ingestion stages')]:
+        lines.append(f'# HELP review_speed_stage_{name} {description}')
+        lines.append(f'# TYPE review_speed_stage_{name} counter')
+        for stage_metrics in metrics['stages']:
+            labels = f'stage="{stage_metrics["stage"]}",domain="{stage_metrics["domain"]}"'
+            lines.append(f'review_speed_stage_{name}{{{labels}}} {stage_metrics[key]}')
+    lines.append('# HELP review_speed_run_elapsed_seconds Wall time since the metrics were reset')
+    lines.append('# TYPE review_speed_run_elapsed_seconds gauge')
+    lines.append(f'review_speed_run_elapsed_seconds {metrics["elapsed_seconds"]}')
+    return '\n'.join(lines) + '\n'
+
+def write_metrics(path=METRICS_PATH, json_path=METRICS_JSON_PATH):
+    """
+    Writes the metrics to path in Prometheus text format (e.g. for the textfile
+    collector of node_exporter) and to json_path. The files are replaced atomically
+    """
+    metrics = get_metrics()
+    with WRITE_LOCK:
+        for file_path, text in [(path, to_prometheus(metrics)), (json_path, json.dumps(metrics, indent=1))]:
+            with open(file_path + '.tmp', 'w') as metrics_file:
+                metrics_file.write(text)
+            os.replace(file_path + '.tmp', file_path)
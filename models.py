@@ -1,13 +1,21 @@
 from mongoengine import *
 import os
 
-if os.path.exists('mongo_atlas_writing_connection_str'):
+if os.environ.get('REVIEW_SPEED_DB'):
+    #> Override the database, e.g. with mongomock://localhost/review_speed 
+    #  (requires mongomock) for offline benchmarks (see replay.py)
+    connection_str = os.environ['REVIEW_SPEED_DB']
+    WRITING_ALLOWED = True
+elif os.path.exists('mongo_atlas_writing_connection_str'):
     connection_str = open('mongo_atlas_writing_connection_str','r').read().rstrip('\n')
     WRITING_ALLOWED = True
 else:
     connection_str = open('mongo_atlas_reading_connection_str','r').read().rstrip('\n')
     WRITING_ALLOWED = False
 client = connect(host=connection_str)
+#> Indexes are declared in each model's meta, and are automatically created on
+#  first use only where writing is allowed (otherwise use `python indexes.py create`)
+AUTO_CREATE_INDEX = WRITING_ALLOWED
 
 class Article(Document):
     doi = StringField(required=False)
@@ -22,6 +30,10 @@ class Article(Document):
     accepted = DateTimeField(required=False)
     published = DateTimeField(required=False)
     journal = ReferenceField('Journal')
+    meta = {
+        'indexes': [('journal', 'published'), 'pmid', 'doi'],
+        'auto_create_index': AUTO_CREATE_INDEX,
+    }
 
 class Journal(Document):
     full_name = StringField(required=True)
@@ -33,13 +45,105 @@ class Journal(Document):
     impact_factor = FloatField(required=False)
     last_failed = BooleanField(required=False) 
     last_checked = DateTimeField(required=False)
+    #> Yield of the journal used by the updater scheduler (see scheduler.score_journal)
+    n_articles_checked = IntField(default=0) # new articles looked up on PubMed or publisher's website
+    n_articles_added = IntField(default=0) # articles added with review dates
+    meta = {
+        'indexes': ['abbr_name', 'nlmcatalog_id'],
+        'auto_create_index': AUTO_CREATE_INDEX,
+    }
 
 class BroadSubjectTerm(Document):
     name = StringField(required=True, unique=True)
     journals = ListField(ReferenceField(Journal))
+    meta = {
+        'auto_create_index': AUTO_CREATE_INDEX,
+    }
 
 class Publisher(Document):
     domain = StringField(required=True, unique=True)
     url = StringField(required=True, unique=True)
     supported = BooleanField(required=True)
-    journals = ListField(ReferenceField(Journal))
\ No newline at end of file
+    journals = ListField(ReferenceField(Journal))
+    meta = {
+        'indexes': ['journals'],
+        'auto_create_index': AUTO_CREATE_INDEX,
+    }
+
+class DOIResolution(Document):
+    doi = StringField(required=True, unique=True)
+    landing_url = StringField(required=False)
+    domain = StringField(required=False)
+    article_url = StringField(required=False)
+    failed = BooleanField(default=False) # negative entry: doi did not resolve to a publisher
+    resolved_at = DateTimeField(required=True)
+    meta = {
+        'auto_create_index': AUTO_CREATE_INDEX,
+    }
+
+class FailedArticle(Document):
+    """
+    Negative cache of the articles whose dates could not be extracted from PubMed
+    or the publisher's website, which are retried with exponential backoff
+    (see data_handling.fetch_journal_articles_data)
+    """
+    pmid = StringField(required=True, unique=True)
+    doi = StringField(required=False)
+    journal = ReferenceField(Journal)
+    publisher_domain = StringField(required=False)
+    reason = StringField(required=False) # 'missing_pubmed_metadata', 'not_in_pubmed', 'page_fetch_failed' or 'no_dates'
+    attempts = IntField(default=1)
+    failed_at = DateTimeField(required=True)
+    next_retry_at = DateTimeField(required=True)
+    meta = {
+        'indexes': ['journal', 'publisher_domain'],
+        'auto_create_index': AUTO_CREATE_INDEX,
+    }
+
+class JournalStats(Document):
+    """
+    Review interval statistics of a journal materialized by the updater, 
+    see stats.summarize_review_intervals for the format of the fields
+    """
+    journal = ReferenceField(Journal, unique=True)
+    abbr_name = StringField(required=True)
+    n_articles = IntField(required=True)
+    first_published = DateTimeField(required=True)
+    last_published = DateTimeField(required=True)
+    intervals = DictField()
+    histograms = DictField()
+    monthly = DictField()
+    updated_at = DateTimeField(required=True)
+    meta = {
+        'indexes': ['abbr_name'],
+        'auto_create_index': AUTO_CREATE_INDEX,
+    }
+
+class UpdaterRun(Document):
+    """
+    Checkpoints of an updater run, used to resume it after an interruption
+    (see updater.update)
+    """
+    started_at = DateTimeField(required=True)
+    finished_at = DateTimeField(required=False)
+    parameters = DictField() # arguments of updater.update which identify the run
+    completed_journals = ListField(ObjectIdField())
+    #> str(journal.id) -> {'cursor': number of processed pmids, 'count': number of search results}
+    pmid_cursors = DictField()
+    meta = {
+        'auto_create_index': AUTO_CREATE_INDEX,
+    }
+
+class DatabaseVersion(Document):
+    """
+    Versions of the articles and their statistics (overall and per journal), 
+    incremented by the updater and read by the app (which may run on another 
+    host) to invalidate its cached data (see stats.mark_database_updated)
+    """
+    name = StringField(primary_key=True)
+    version = IntField(default=0)
+    journals = DictField() # str(journal.id) -> version of the articles of the journal
+    updated_at = DateTimeField(required=False)
+    meta = {
+        'auto_create_index': AUTO_CREATE_INDEX,
+    }
\ No newline at end of file
@@ -0,0 +1,230 @@
+"""
+Offline bulk ingestion of the articles of the journals in the database from
+the PubMed baseline and daily update files (gzipped XML files of all PubMed
+citations), as an alternative to fetching them from E-utilities one journal
+at a time, e.g. to back-fill the database. The files are downloaded and parsed
+in parallel by a pool of processes, except for the update files which revise
+or delete the citations of the previous files and are ingested one at a time
+in order. Each file is streamed and the parsed articles are discarded, so that
+the memory used is bounded per file. Usage:
+    python pubmed_baseline.py baseline [--workers N] [--first pubmed24n0001.xml.gz] [--last ...]
+    python pubmed_baseline.py updatefiles [--first ...] [--last ...]
+"""
+import os, re, gzip, argparse
+import multiprocessing
+
+import requests
+
+from models import Journal, Article, WRITING_ALLOWED
+import data_handling
+import stats
+from helpers import download_file, iterparse_elements
+
+PUBMED_FILES_URLS = {
+    'baseline': 'https://ftp.ncbi.nlm.nih.gov/pubmed/baseline/',
+    'updatefiles': 'https://ftp.ncbi.nlm.nih.gov/pubmed/updatefiles/',
+}
+PUBMED_FILES_DIR = os.path.join('data', 'pubmed')
+WORKERS = os.cpu_count() # number of files processed in parallel
+
+#> journal abbr_name (MedlineTA) -> id, set in each worker process by init_worker
+JOURNAL_IDS = {}
+
+
+def list_pubmed_files(kind='baseline'):
+    """
+    Lists the names of the baseline or update files
+
+    Parameters
+    ----------
+    kind: (str) 'baseline' or 'updatefiles'
+
+    Returns
+    ----------
+    filenames: (list of str) sorted, e.g. ['pubmed24n0001.xml.gz', ...]
+    """
+    res = requests.get(PUBMED_FILES_URLS[kind])
+    res.raise_for_status()
+    return sorted(set(re.findall(r'pubmed\d+n\d+\.xml\.gz(?!\.md5)', res.text)))
+
+def get_journal_ids():
+    """
+    Gets the ids of the journals in the database by their abbr_name, which is
+    the MedlineTA used in PubMed citations
+
+    Returns
+    ----------
+    journal_ids: (dict) abbr_name -> ObjectId
+    """
+    return {
+        journal['abbr_name']: journal['_id']
+        for journal in Journal.objects.only('abbr_name').as_pymongo()
+    }
+
+def iter_pubmed_file(path):
+    """
+    Streams the citations of a (gzipped) PubMed XML file. Each element
+    is removed from the tree after it is processed
+
+    Parameters
+    ----------
+    path: (str)
+
+    Yields
+    ----------
+    element: (xml.etree.ElementTree.Element) PubmedArticle or DeleteCitation element
+    """
+    with gzip.open(path, 'rb') as pubmed_file:
+        chunks = iter(lambda: pubmed_file.read(data_handling.STREAM_CHUNK_SIZE), b'')
+        yield from iterparse_elements(chunks, ['PubmedArticle', 'DeleteCitation'])
+
+def ingest_pubmed_file(path, bulk_write_size=data_handling.BULK_WRITE_SIZE):
+    """
+    Adds the articles of the journals in JOURNAL_IDS with PubMed review dates
+    from a PubMed XML file to the database, and deletes the articles of
+    deleted citations. The articles are upserted on pmid, so that the files
+    can be re-ingested
+
+    Parameters
+    ----------
+    path: (str)
+    bulk_write_size: (int) number of article writes sent to the database together
+
+    Returns
+    ----------
+    n_citations: (int) number of citations in the file
+    journal_ids: (set) ids of the journals to which articles were added or from which they were deleted
+    """
+    n_citations = 0
+    journal_ids = set()
+    deleted_pmids = []
+    #> Articles without pmid (only doi) get the pmid instead of being added again
+    doi_only_dois = set(Article.objects(pmid__in=[None, '']).scalar('doi'))
+    with data_handling.ArticleWriter(flush_size=bulk_write_size) as article_writer:
+        for element in iter_pubmed_file(path):
+            if element.tag == 'DeleteCitation':
+                deleted_pmids += [pmid_element.text for pmid_element in element.findall('PMID')]
+                continue
+            n_citations += 1
+            medline_citation = element.find('MedlineCitation')
+            journal_id = JOURNAL_IDS.get(medline_citation.findtext('MedlineJournalInfo/MedlineTA'))
+            if journal_id is None:
+                continue
+            pmid = medline_citation.find('PMID').text
+            try:
+                dates, metadata = data_handling.parse_pubmed_article(element, verbosity=None)
+            except (AttributeError, TypeError): # missing pubmed metadata
+                continue
+            if (dates['Received'] is None) or ((dates['Accepted'] is None) and (dates['Published'] is None)):
+                continue
+            if metadata['doi'] and (metadata['doi'] in doi_only_dois):
+                article_writer.set_pmid(metadata['doi'], pmid)
+                continue
+            article_writer.add(data_handling.create_article(pmid, dates, metadata, journal_id))
+            journal_ids.add(journal_id)
+    if deleted_pmids:
+        deleted_articles = Article.objects(pmid__in=deleted_pmids)
+        journal_ids.update(article['journal'] for article in deleted_articles.only('journal').as_pymongo() if 'journal' in article)
+        deleted_articles.delete()
+    return n_citations, journal_ids
+
+def process_pubmed_file(filename, kind='baseline', keep_files=False):
+    """
+    Downloads (if needed) and ingests a baseline or update file in a worker process
+
+    Returns
+    ----------
+    filename: (str)
+    n_citations: (int)
+    journal_ids: (set)
+    """
+    path = os.path.join(PUBMED_FILES_DIR, filename)
+    if not os.path.exists(path):
+        #> Download to a temporary file so that interrupted downloads are not ingested
+        download_file(PUBMED_FILES_URLS[kind] + filename, path + '.part')
+        os.replace(path + '.part', path)
+    n_citations, journal_ids = ingest_pubmed_file(path)
+    if not keep_files:
+        os.remove(path)
+    return filename, n_citations, journal_ids
+
+def process_pubmed_file_args(args):
+    return process_pubmed_file(*args)
+
+def init_worker(journal_ids):
+    """
+    Sets the journals whose articles are ingested by the worker process
+    """
+    JOURNAL_IDS.update(journal_ids)
+
+def ingest_pubmed_files(kind='baseline', filenames=None, workers=WORKERS, keep_files=False, verbosity='full'):
+    """
+    Ingests the baseline files in parallel, or the update files one at a time
+    in the order of their names, and then updates the statistics of the journals 
+    with new articles
+
+    Parameters
+    ----------
+    kind: (str) 'baseline' or 'updatefiles'
+    filenames: (list of str or None) None will ingest all the files
+    workers: (int) number of processes for the baseline files, 1 ingests the files in this process
+    keep_files: (bool) keep the downloaded files in PUBMED_FILES_DIR
+    verbosity: (str or None) 'full' prints every file
+
+    Returns
+    ----------
+    n_citations: (int) number of citations in the files
+    """
+    if not WRITING_ALLOWED:
+        print("Writing to db not allowed on this machine")
+        return 0
+    if filenames is None:
+        filenames = list_pubmed_files(kind)
+    os.makedirs(PUBMED_FILES_DIR, exist_ok=True)
+    if kind == 'updatefiles':
+        #> A citation revised in an update file can be revised again or deleted in the next files
+        filenames = sorted(filenames)
+        workers = 1
+    journal_ids = get_journal_ids()
+    args = [(filename, kind, keep_files) for filename in filenames]
+    n_citations = 0
+    updated_journal_ids = set()
+    if workers > 1:
+        #> Spawn (instead of fork) the workers so that each opens its own database connection
+        with multiprocessing.get_context('spawn').Pool(workers, initializer=init_worker, initargs=(journal_ids,)) as pool:
+            results = pool.imap_unordered(process_pubmed_file_args, args)
+            for counter, (filename, file_n_citations, file_journal_ids) in enumerate(results):
+                n_citations += file_n_citations
+                updated_journal_ids.update(file_journal_ids)
+                if verbosity=='full':
+                    print(f'{counter+1} of {len(filenames)}: {filename} ({file_n_citations} citations)')
+    else:
+        init_worker(journal_ids)
+        for counter, file_args in enumerate(args):
+            filename, file_n_citations, file_journal_ids = process_pubmed_file(*file_args)
+            n_citations += file_n_citations
+            updated_journal_ids.update(file_journal_ids)
+            if verbosity=='full':
+                print(f'{counter+1} of {len(filenames)}: {filename} ({file_n_citations} citations)')
+    #> Materialize the statistics of the updated journals
+    for journal in Journal.objects(id__in=list(updated_journal_ids)):
+        stats.update_journal_stats(journal)
+    if updated_journal_ids:
+        stats.mark_database_updated(updated_journal_ids)
+    if verbosity:
+        print(f'{n_citations} citations ingested, {len(updated_journal_ids)} journals updated')
+    return n_citations
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingests the PubMed baseline or update files')
+    parser.add_argument('kind', choices=list(PUBMED_FILES_URLS))
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--first', help='first file to ingest')
+    parser.add_argument('--last', help='last file to ingest')
+    parser.add_argument('--keep-files', action='store_true', help='keep the downloaded files')
+    args = parser.parse_args()
+    filenames = [
+        filename for filename in list_pubmed_files(args.kind)
+        if ((args.first is None) or (filename >= args.first)) and ((args.last is None) or (filename <= args.last))
+    ]
+    ingest_pubmed_files(args.kind, filenames, workers=args.workers, keep_files=args.keep_files)
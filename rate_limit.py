@@ -0,0 +1,77 @@
+"""
+Token bucket rate limiters shared by the threads of the updater, which keep
+the requests within the NCBI E-utilities limits and the politeness limits of
+each publisher domain
+"""
+import os, time, threading
+
+import metrics
+
+#> NCBI allows 3 requests per second without and 10 with an API key
+NCBI_API_KEY = os.environ.get('NCBI_API_KEY')
+NCBI_RATE = 10 if NCBI_API_KEY else 3 # requests per second
+DOMAIN_RATE = 1 # requests per second per publisher domain
+DOMAIN_RATES = {
+    'doi.org': 5,
+}
+ENABLED = True # disabled when replaying recorded responses (see replay.py)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket which refills at rate tokens per second up to capacity
+
+    Parameters
+    ----------
+    rate: (float) tokens per second
+    capacity: (float) maximum number of tokens, i.e. the allowed burst
+    name: (str) domain under which the waiting times are recorded in metrics
+    """
+    def __init__(self, rate, capacity=1, name=''):
+        self.rate = rate
+        self.name = name
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Takes tokens from the bucket, and blocks until they are available
+        """
+        if not ENABLED:
+            return
+        start = time.perf_counter()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    break
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+        metrics.observe('rate_limit_wait', self.name, time.perf_counter() - start)
+
+ncbi_limiter = TokenBucket(NCBI_RATE, name='ncbi')
+DOMAIN_LIMITERS = {}
+DOMAIN_LIMITERS_LOCK = threading.Lock()
+
+def get_domain_limiter(domain):
+    """
+    Gets the rate limiter of a publisher domain (or doi.org), which is
+    created on first use with DOMAIN_RATES[domain] or DOMAIN_RATE
+
+    Parameters
+    ----------
+    domain: (str)
+
+    Returns
+    ----------
+    limiter: (TokenBucket)
+    """
+    with DOMAIN_LIMITERS_LOCK:
+        if domain not in DOMAIN_LIMITERS:
+            DOMAIN_LIMITERS[domain] = TokenBucket(DOMAIN_RATES.get(domain, DOMAIN_RATE), name=domain)
+        return DOMAIN_LIMITERS[domain]
@@ -0,0 +1,201 @@
+"""
+Record/replay of the HTTP responses used in the ingestion of a journal
+(NLM Catalog and PubMed E-utilities XML, doi.org redirects and publisher pages),
+which are stored as <FIXTURES_DIR>/<request key>.json.gz and are served back
+to both requests and tls_client call sites, to benchmark and test the
+pipeline offline.
+
+The journal is ingested into an empty database which should be overridden
+by a mongomock (or local) database. Usage:
+    REVIEW_SPEED_DB=mongomock://localhost/review_speed python replay.py record issn [fixtures_dir]
+    REVIEW_SPEED_DB=mongomock://localhost/review_speed python replay.py replay issn [fixtures_dir]
+See also `python benchmarks.py ingestion`
+"""
+import os, sys, json, gzip, base64, hashlib, logging, contextlib
+
+import requests
+import tls_client
+
+import models
+from models import Article, Journal, Publisher, BroadSubjectTerm, DOIResolution, JournalStats, FailedArticle
+import data_handling
+import rate_limit
+
+FIXTURES_DIR = 'fixtures'
+EXCLUDED_PARAMS = ['api_key'] # not stored or used in the request keys
+
+logger = logging.getLogger('replay_logger')
+
+
+class ReplayResponse:
+    """
+    Recorded response with the attributes of requests and tls_client responses
+    used in the pipeline
+    """
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.history = []
+
+    @property
+    def text(self):
+        return self.content.decode(errors='replace')
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.exceptions.HTTPError(f'{self.status_code} for url {self.url}')
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        for chunk_start in range(0, len(self.content), chunk_size):
+            yield self.content[chunk_start:chunk_start+chunk_size]
+
+    def close(self):
+        pass
+
+def get_request_key(method, url, params=None, data=None):
+    """
+    Gets the key of a request from its method, url, parameters and data
+
+    Returns
+    ----------
+    key: (str) sha1 hex digest
+    request: (dict) normalized request
+    """
+    def normalize(values):
+        if values is None:
+            return None
+        if isinstance(values, (str, bytes)):
+            return values.decode(errors='replace') if isinstance(values, bytes) else values
+        return sorted([str(k), str(v)] for k, v in dict(values).items() if k not in EXCLUDED_PARAMS)
+    request = {'method': method.upper(), 'url': url, 'params': normalize(params), 'data': normalize(data)}
+    key = hashlib.sha1(json.dumps(request, sort_keys=True).encode()).hexdigest()
+    return key, request
+
+class FixtureStore:
+    """
+    Store of the recorded responses in fixtures_dir
+
+    Parameters
+    ----------
+    fixtures_dir: (str)
+    """
+    def __init__(self, fixtures_dir=FIXTURES_DIR):
+        self.fixtures_dir = fixtures_dir
+        self.hits = 0
+        self.misses = []
+
+    def get_path(self, key):
+        return os.path.join(self.fixtures_dir, f'{key}.json.gz')
+
+    def save(self, key, request, response):
+        """
+        Stores a requests or tls_client response of the request
+        """
+        os.makedirs(self.fixtures_dir, exist_ok=True)
+        fixture = {
+            'request': request,
+            'url': response.url,
+            'status_code': response.status_code,
+            'headers': {'Content-Type': response.headers.get('Content-Type', '')},
+            'content': base64.b64encode(response.content).decode(),
+        }
+        with gzip.open(self.get_path(key), 'wt') as fixture_file:
+            json.dump(fixture, fixture_file)
+
+    def load(self, key, request):
+        """
+        Loads the recorded response of the request
+
+        Raises
+        ----------
+        requests.exceptions.ConnectionError if the request was not recorded
+        """
+        if not os.path.exists(self.get_path(key)):
+            self.misses.append(request)
+            raise requests.exceptions.ConnectionError(f"No recorded response for {request['method']} {request['url']}")
+        with gzip.open(self.get_path(key), 'rt') as fixture_file:
+            fixture = json.load(fixture_file)
+        self.hits += 1
+        return ReplayResponse(fixture['url'], fixture['status_code'], fixture['headers'], base64.b64decode(fixture['content']))
+
+@contextlib.contextmanager
+def patched_http(fixtures_dir=FIXTURES_DIR, mode='replay'):
+    """
+    Patches the requests sessions (also used by requests.get and requests.post)
+    and tls_client sessions to record their responses in, or replay them from,
+    the fixtures. Rate limits are disabled while replaying
+
+    Parameters
+    ----------
+    fixtures_dir: (str)
+    mode: (str) 'record' or 'replay'
+
+    Yields
+    ----------
+    store: (FixtureStore)
+    """
+    store = FixtureStore(fixtures_dir)
+    original_requests_request = requests.sessions.Session.request
+    original_tls_client_request = tls_client.Session.execute_request
+    def patch(original_request):
+        def patched_request(session, method, url, params=None, data=None, **kwargs):
+            key, request = get_request_key(method, url, params, data)
+            if mode == 'replay':
+                return store.load(key, request)
+            response = original_request(session, method, url, params=params, data=data, **kwargs)
+            store.save(key, request, response)
+            return response
+        return patched_request
+    requests.sessions.Session.request = patch(original_requests_request)
+    tls_client.Session.execute_request = patch(original_tls_client_request)
+    rate_limit_enabled = rate_limit.ENABLED
+    rate_limit.ENABLED = (mode != 'replay')
+    try:
+        yield store
+    finally:
+        requests.sessions.Session.request = original_requests_request
+        tls_client.Session.execute_request = original_tls_client_request
+        rate_limit.ENABLED = rate_limit_enabled
+
+def clear_database():
+    """
+    Drops the collections filled by ingest_journal. Only allowed on mongomock databases
+    """
+    if not models.connection_str.startswith('mongomock://'):
+        raise RuntimeError("Set REVIEW_SPEED_DB to a mongomock database to ingest journals offline")
+    for model in [Article, Journal, Publisher, BroadSubjectTerm, DOIResolution, JournalStats, FailedArticle]:
+        model.drop_collection()
+
+def ingest_journal(issn, max_results=10000):
+    """
+    Adds the journal with issn from NLM Catalog to the (empty) database and
+    fetches its articles data
+
+    Returns
+    ----------
+    journal: (Journal or None) None if the journal was not added
+    """
+    clear_database()
+    data_handling.fetch_journals_info_from_nlmcatalog(issn=issn, verbosity=None)
+    journal = Journal.objects(issns=issn).first()
+    if journal is None:
+        return None
+    data_handling.fetch_journal_articles_data(journal.abbr_name, max_results=max_results, verbosity=None, logger=logger)
+    return journal
+
+if __name__ == '__main__':
+    mode, issn = sys.argv[1:3]
+    fixtures_dir = sys.argv[3] if len(sys.argv) > 3 else FIXTURES_DIR
+    with patched_http(fixtures_dir, mode) as store:
+        journal = ingest_journal(issn)
+    print(f"{mode}: {journal.abbr_name if journal else 'no journal'}, {Article.objects.count()} articles "
+          f"({store.hits} replayed and {len(store.misses)} missing responses)")
@@ -0,0 +1,115 @@
+"""
+Scheduling of the journals updated by the updater. The stale journals of all
+selected parents are collected once, and ordered by a score combining their
+staleness, historical yield, the success rate of their publisher and whether
+they failed last time
+"""
+import datetime
+
+from mongoengine.queryset.visitor import Q
+
+from models import Journal, Publisher
+
+PRIOR_WEIGHT = 20 # number of pseudo-articles given the publisher success rate when estimating the yield of a journal
+DEFAULT_SUCCESS_RATE = 0.5 # assumed success rate of publishers without any checked articles
+MIN_YIELD = 0.01 # so that journals without any yield are still updated eventually
+LAST_FAILED_PENALTY = 0.2
+NEVER_CHECKED = datetime.datetime(2020, 1, 1) # assumed last_checked of the journals which were never checked
+
+
+def get_parents_journal_ids(parents):
+    """
+    Gets the unique ids of the journals of parents (Publisher or BroadSubjectTerm
+    QuerySet) without dereferencing the journals
+
+    Returns
+    ----------
+    journal_ids: (set) of ObjectId
+    """
+    journal_ids = set()
+    for parent in parents.only('journals').no_dereference().as_pymongo():
+        journal_ids.update(parent.get('journals', []))
+    return journal_ids
+
+def get_publisher_success_rates():
+    """
+    Calculates the success rate of publishers as the ratio of added to checked
+    articles, pooled over all of their journals
+
+    Returns
+    ----------
+    publisher_success_rates: (dict) journal id -> success rate of its publisher
+    """
+    journal_counts = {
+        journal['_id']: (journal.get('n_articles_checked', 0), journal.get('n_articles_added', 0))
+        for journal in Journal.objects.only('n_articles_checked', 'n_articles_added').as_pymongo()
+    }
+    publisher_success_rates = {}
+    for publisher in Publisher.objects.only('journals').no_dereference().as_pymongo():
+        journal_ids = publisher.get('journals', [])
+        n_checked = sum(journal_counts.get(journal_id, (0, 0))[0] for journal_id in journal_ids)
+        n_added = sum(journal_counts.get(journal_id, (0, 0))[1] for journal_id in journal_ids)
+        success_rate = n_added / n_checked if n_checked else DEFAULT_SUCCESS_RATE
+        for journal_id in journal_ids:
+            publisher_success_rates[journal_id] = success_rate
+    return publisher_success_rates
+
+def score_journal(journal, publisher_success_rate, update_interval, now):
+    """
+    Scores a journal for scheduling (higher is updated first). The yield of
+    the journal (added per checked articles) is shrunk towards the success
+    rate of its publisher, which dominates for rarely checked journals
+
+    Parameters
+    ----------
+    journal: (dict) raw journal with last_checked, last_failed, n_articles_checked and n_articles_added
+    publisher_success_rate: (float)
+    update_interval: (int) days after which a journal is stale
+    now: (datetime.datetime)
+
+    Returns
+    ----------
+    score: (float)
+    """
+    staleness = (now - (journal.get('last_checked') or NEVER_CHECKED)).days / update_interval
+    journal_yield = (
+        (journal.get('n_articles_added', 0) + PRIOR_WEIGHT * publisher_success_rate)
+        / (journal.get('n_articles_checked', 0) + PRIOR_WEIGHT))
+    score = staleness * max(journal_yield, MIN_YIELD)
+    if journal.get('last_failed'):
+        score *= LAST_FAILED_PENALTY
+    return score
+
+def schedule_journals(parents, update_interval, skip_last_failed=False, exclude_ids=()):
+    """
+    Collects the unique stale journals of parents and orders them by their score
+
+    Parameters
+    ----------
+    parents: (QuerySet) of Publisher or BroadSubjectTerm
+    update_interval: (int) days after which a journal is stale
+    skip_last_failed: (bool) exclude the journals which failed last time
+    exclude_ids: (iterable) of journal ids to exclude, e.g. completed in an interrupted run
+
+    Returns
+    ----------
+    journals: (list) of (Journal) ordered by score
+    """
+    now = datetime.datetime.now()
+    journal_ids = get_parents_journal_ids(parents).difference(exclude_ids)
+    stale_journals = Journal.objects(
+        Q(last_checked__lte=now - datetime.timedelta(days=update_interval+1)) | Q(last_checked=None),
+        id__in=list(journal_ids))
+    if skip_last_failed:
+        stale_journals = stale_journals.filter(last_failed__ne=True)
+    stale_journals = list(stale_journals.only(
+        'last_checked', 'last_failed', 'n_articles_checked', 'n_articles_added').as_pymongo())
+    if not stale_journals:
+        return []
+    publisher_success_rates = get_publisher_success_rates()
+    scores = {
+        journal['_id']: score_journal(journal, publisher_success_rates.get(journal['_id'], DEFAULT_SUCCESS_RATE), update_interval, now)
+        for journal in stale_journals
+    }
+    journals = Journal.objects(id__in=list(scores)).only('abbr_name', 'last_checked')
+    return sorted(journals, key=lambda journal: scores[journal.id], reverse=True)
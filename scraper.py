@@ -1,16 +1,28 @@
 import requests
 import tls_client
 import urllib
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import tldextract
 import datetime
+import time
 import re
-from helpers import datestr_tuple_to_datetime
+import threading
+import contextlib
+from dates import datestr_tuple_to_datetime
+import rate_limit
+import metrics
+from models import DOIResolution, WRITING_ALLOWED
 
 REQUESTS_AGENT_HEADERS = {"User-Agent":"Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:121.0) Gecko/20100101 Firefox/121.0"}
 EVENTS = ['Received', 'Accepted', 'Published']
 DOI_BASE = 'https://doi.org/'
 USE_REQUESTS = []
+DOI_SESSION_KEY = 'doi.org' # key of the (requests) sessions used for resolving dois in SESSION_POOL
+SESSION_POOL_SIZE = 4 # max number of idle sessions kept per publisher domain
+SESSION_MAX_REUSE = 200 # number of requests after which a session is rotated
+DOI_CACHE_TTL = 180 # days
+DOI_CACHE_NEGATIVE_TTL = 14 # days, for dois that did not resolve to a publisher
+BLOCKED_STATUS_CODES = (403, 429) # responses of rate limited or blocked requests (as well as 5xx)
 
 #TODO: move these to json files
 REGEX_PATTERNS = {
@@ -120,31 +132,199 @@ SOAP_FUNCITONS = {
     'oup': oup_get_dates,
 }
 
+#> Elements needed by the soap functions. Only these are added to the soup
+#  instead of building the tree of the whole html (None parses everything)
+SOAP_STRAINERS = {
+    'springer': SoupStrainer('time'),
+    'springeropen': SoupStrainer('time'),
+    'nature': SoupStrainer('time'),
+    'biomedcentral': SoupStrainer('time'),
+    'hindawi': None, # uses the parent of the labels
+    #> unlike find_all, a string class does not match divs with other classes as well
+    'oup': SoupStrainer('div', attrs={'class': lambda classes: classes is not None and 'history-entry' in classes.split()}),
+}
+
 SUPPORTED_DOMAINS = set(SOAP_FUNCITONS.keys()).union(set(REGEX_PATTERNS))
 
+##########################################################
+################ Compiled Regex Patterns #################
+##########################################################
+def compile_regex_pattern(regex):
+    """
+    Compiles a pattern of REGEX_PATTERNS without its leading ".*", which makes
+    re.match backtrack over the whole html. Instead, the matches are located by
+    searching for the literal prefix of the pattern (the anchor) with str.rfind
+
+    Parameters
+    ----------
+    regex: (str) e.g. REGEX_PATTERNS['karger']['Received']
+
+    Returns
+    ----------
+    compiled_regex: (re.Pattern)
+    anchor: (str) literal prefix of the pattern, e.g. 'Received: '
+    """
+    if regex.startswith('.*'):
+        regex = regex[2:]
+    anchor = re.match(r'[^\\\[\](){}.*+?^$|]*', regex).group()
+    if regex[len(anchor):len(anchor)+1] in ('*', '+', '?', '{'):
+        #> the last character is quantified and is not part of the anchor
+        anchor = anchor[:-1]
+    if not anchor:
+        #> no literal prefix to search for, fall back to greedy match
+        return re.compile(f'.*(?:{regex})', flags=re.DOTALL), ''
+    return re.compile(regex, flags=re.DOTALL), anchor
+
+def find_datestr_tuple(compiled_regex, anchor, html):
+    """
+    Finds the date strings of the last match of a compiled pattern in the html,
+    which is the same match as re.match with the original greedy ".*" pattern
+
+    Parameters
+    ----------
+    compiled_regex, anchor: output of compile_regex_pattern
+    html: (str)
+
+    Returns
+    ----------
+    datestr_tuple: (tuple or None) e.g. ('July', '13', '2020')
+    """
+    if not anchor:
+        match = compiled_regex.match(html)
+        return match.groups() if match else None
+    end = len(html)
+    while True:
+        pos = html.rfind(anchor, 0, end)
+        if pos < 0:
+            return None
+        match = compiled_regex.match(html, pos)
+        if match:
+            return match.groups()
+        end = pos + len(anchor) - 1
+
+#> Compiled once at import: publisher domain -> list of {event: (compiled_regex, anchor) or None}
+COMPILED_REGEX_PATTERNS = {
+    domain: [
+        {event: (compile_regex_pattern(regex) if regex else None) for event, regex in regex_pattern_dict.items()}
+        for regex_pattern_dict in (regex_pattern_dicts if isinstance(regex_pattern_dicts, list) else [regex_pattern_dicts])
+    ]
+    for domain, regex_pattern_dicts in REGEX_PATTERNS.items()
+}
+
+##########################################################
+#################### Session Pooling #####################
+##########################################################
+#> Idle sessions per publisher domain as lists of [session, n_uses],
+#  shared by all the calls (and threads) in a run
+SESSION_POOL = {}
+SESSION_POOL_LOCK = threading.Lock()
+
+def new_session(publisher_domain):
+    """
+    Creates a new requests or tls_client session for the publisher domain
+    """
+    if (publisher_domain == DOI_SESSION_KEY) or (publisher_domain in USE_REQUESTS):
+        session = requests.sessions.Session()
+        session.headers.update(REQUESTS_AGENT_HEADERS)
+    else:
+        session = tls_client.Session(client_identifier='chrome112', random_tls_extension_order=True)
+    return session
+
+def close_session(session):
+    """
+    Closes the connections of a session (tls_client sessions may not support it)
+    """
+    if hasattr(session, 'close'):
+        session.close()
+
+@contextlib.contextmanager
+def pooled_session(publisher_domain):
+    """
+    Checks out a keep-alive session of the publisher domain from SESSION_POOL
+    and returns it to the pool after use. Sessions are rotated after SESSION_MAX_REUSE
+    requests, and are discarded if the request raises an error
+
+    Parameters
+    ----------
+    publisher_domain: (str) publisher's domain name or DOI_SESSION_KEY
+
+    Yields
+    ----------
+    session: (requests.sessions.Session or tls_client.Session)
+    """
+    with SESSION_POOL_LOCK:
+        idle_sessions = SESSION_POOL.setdefault(publisher_domain, [])
+        if idle_sessions:
+            session, n_uses = idle_sessions.pop()
+        else:
+            session, n_uses = new_session(publisher_domain), 0
+    try:
+        yield session
+    except:
+        close_session(session)
+        raise
+    n_uses += 1
+    with SESSION_POOL_LOCK:
+        idle_sessions = SESSION_POOL.setdefault(publisher_domain, [])
+        if (n_uses < SESSION_MAX_REUSE) and (len(idle_sessions) < SESSION_POOL_SIZE):
+            idle_sessions.append([session, n_uses])
+            return
+    close_session(session)
+
+def close_sessions():
+    """
+    Closes and removes all the pooled sessions, e.g. at the end of an updater run
+    """
+    with SESSION_POOL_LOCK:
+        for idle_sessions in SESSION_POOL.values():
+            for session, _ in idle_sessions:
+                close_session(session)
+        SESSION_POOL.clear()
+
 ##########################################################
 #################### Main Functions ######################
 ##########################################################
-def get_article_url(doi):
+class PageFetchError(Exception):
     """
-    Converts doi url to article url and returns the domain name as the publisher name
-    
+    Raised when the doi or the article page could not be fetched, e.g. after
+    connection errors, timeouts and blocked requests, as opposed to the pages
+    which were fetched but have no dates
+    """
+
+def check_response(res, publisher_domain):
+    """
+    Raises PageFetchError if the request was blocked or the server failed
+    """
+    if (res.status_code in BLOCKED_STATUS_CODES) or (res.status_code >= 500):
+        raise PageFetchError(f"{publisher_domain} responded with {res.status_code}")
+
+def resolve_doi(doi):
+    """
+    Follows the doi.org redirect and converts the landing url to article url
+
     Parameters
     ----------
-    doi_url: (str) url of the form https://doi.org/XXXX
+    doi: (str) article doi
 
     Returns
     ----------
-    article_url: (str) url of the page that contains review dates
+    landing_url: (str) url that doi.org redirects to
+    domain: (str) domain name of the landing url
+    article_url: (str) url of the page that contains review dates, or None if
+        the doi does not redirect to a publisher
     """
     #> Get the domain name
     doi_url = DOI_BASE + doi
-    doi_res = requests.get(doi_url, headers=REQUESTS_AGENT_HEADERS)
+    rate_limit.get_domain_limiter(DOI_SESSION_KEY).acquire()
+    with pooled_session(DOI_SESSION_KEY) as session, metrics.timed('doi_resolve', DOI_SESSION_KEY) as record:
+        doi_res = session.get(doi_url)
+        record['bytes'] = len(doi_res.content)
+        check_response(doi_res, DOI_SESSION_KEY)
     domain = tldextract.extract(doi_res.url).domain
     #> For some publishers (elsevier) the redirection doesn't work properly, and
     #  we need another publisher-specific way to get to the article_url
     if domain=='doi':
-        raise ValueError(f"Unable to parse article url from the doi {doi}")
+        article_url = None
     elif domain == 'elsevier':
         sciencedirect_id = doi_res.url.split('/')[-1]
         article_url = 'https://www.sciencedirect.com/science/article/pii/' + sciencedirect_id
@@ -152,6 +332,43 @@ def get_article_url(doi):
         article_url = 'https://onlinelibrary.wiley.com/action/ajaxShowPubInfo?doi=' + urllib.parse.quote(doi, safe='')
     else:
         article_url = doi_res.url
+    return doi_res.url, domain, article_url
+
+def get_article_url(doi, use_cache=True):
+    """
+    Converts doi url to article url and returns the domain name as the publisher name.
+    Resolved dois (and the ones that failed to resolve) are cached in the database
+    for DOI_CACHE_TTL (DOI_CACHE_NEGATIVE_TTL) days
+    
+    Parameters
+    ----------
+    doi: (str) article doi
+    use_cache: (bool) look up and store the resolution in DOIResolution collection
+
+    Returns
+    ----------
+    article_url: (str) url of the page that contains review dates
+    """
+    now = datetime.datetime.now()
+    if use_cache:
+        cached = DOIResolution.objects(doi=doi).first()
+        if cached is not None:
+            ttl = DOI_CACHE_NEGATIVE_TTL if cached.failed else DOI_CACHE_TTL
+            if (now - cached.resolved_at).days < ttl:
+                if cached.failed:
+                    raise ValueError(f"Unable to parse article url from the doi {doi} (cached)")
+                return cached.article_url
+    landing_url, domain, article_url = resolve_doi(doi)
+    if use_cache and WRITING_ALLOWED:
+        DOIResolution.objects(doi=doi).update_one(
+            upsert=True,
+            set__landing_url=landing_url,
+            set__domain=domain,
+            set__article_url=article_url,
+            set__failed=article_url is None,
+            set__resolved_at=now)
+    if article_url is None:
+        raise ValueError(f"Unable to parse article url from the doi {doi}")
     return article_url
 
 def get_dates(doi, publisher_domain, logger=None):
@@ -167,6 +384,10 @@ def get_dates(doi, publisher_domain, logger=None):
     Returns
     ----------
     dates: (dict) datetime.datetime objs for three events (Received, Accepted, Published)
+
+    Raises
+    ----------
+    PageFetchError if the doi could not be resolved or the article page could not be fetched
     """
     #TODO: get revised date
     dates = {'Received': None, 'Revised': None, 'Accepted': None, 'Published': None}
@@ -175,34 +396,36 @@ def get_dates(doi, publisher_domain, logger=None):
         return dates
     try:
         article_url = get_article_url(doi)
-    except:
+    except ValueError:
         logger.info("Unable to parse publisher and article url from the doi")
         return dates
-    #> Get the HTML
-    if publisher_domain in USE_REQUESTS:
-        session = requests.sessions.Session()
-    else:
-        session = tls_client.Session(client_identifier='chrome112', random_tls_extension_order=True)
+    except PageFetchError:
+        raise
+    except Exception as e:
+        raise PageFetchError(f"Unable to resolve the doi: {e!r}") from e
+    #> Get the HTML using a pooled session of the publisher, within its rate limit
+    rate_limit.get_domain_limiter(publisher_domain).acquire()
     try:
-        if publisher_domain in USE_REQUESTS:
-            html = session.get(article_url, headers=REQUESTS_AGENT_HEADERS).content.decode(errors='replace')
-        else:
-            html = session.get(article_url).content.decode(errors='replace')
-    except:
-        logger.info("Unable to get article url page")
-        return dates
-    regex_pattern_dicts = REGEX_PATTERNS.get(publisher_domain, [])
+        with pooled_session(publisher_domain) as session, metrics.timed('page_fetch', publisher_domain) as record:
+            res = session.get(article_url)
+            record['bytes'] = len(res.content)
+            check_response(res, publisher_domain)
+        html = res.content.decode(errors='replace')
+    except PageFetchError:
+        raise
+    except Exception as e:
+        raise PageFetchError(f"Unable to get the article page: {e!r}") from e
+    compiled_regex_patterns = COMPILED_REGEX_PATTERNS.get(publisher_domain, [])
     soap_function = SOAP_FUNCITONS.get(publisher_domain, {})
+    parse_start, parse_cpu_start = time.perf_counter(), time.thread_time()
     #> For some publishers we can use regex
-    if not isinstance(regex_pattern_dicts, list):
-        regex_pattern_dicts = [regex_pattern_dicts]
-    if regex_pattern_dicts:
-        for regex_pattern_dict in regex_pattern_dicts:
-            for event, regex in regex_pattern_dict.items():
+    if compiled_regex_patterns:
+        for compiled_regex_pattern_dict in compiled_regex_patterns:
+            for event, compiled_regex_pattern in compiled_regex_pattern_dict.items():
                 try:
                     #> Use prespecified regex_patterns to get date tuples, 
                     #  e.g.: ('July', '13', '2020'), ('13', '12', '2020'), etc.
-                    datestr_tuple = re.match(regex, html, flags=re.DOTALL).groups()
+                    datestr_tuple = find_datestr_tuple(*compiled_regex_pattern, html)
                     #> Convert the tuples to datetime objs based on publisher's datestr pattern,
                     #  e.g.: BdY (full month name, day, full year)
                     dates[event] = datestr_tuple_to_datetime(datestr_tuple, DATESTR_PATTERNS[publisher_domain])
@@ -217,7 +440,7 @@ def get_dates(doi, publisher_domain, logger=None):
         #  and the output is a tuple (received, accepted, published)
         # TODO: Better handling of errors
         try:
-            soup = BeautifulSoup(html, features='html.parser')
+            soup = BeautifulSoup(html, features='html.parser', parse_only=SOAP_STRAINERS.get(publisher_domain))
             parsed_dates = soap_function(soup)
         except:
             logger.debug("Soap failed")
@@ -227,4 +450,8 @@ def get_dates(doi, publisher_domain, logger=None):
                 dates[EVENTS[event_idx]] = parsed_dates[event_idx]
     else:
         logger.debug(f"{publisher_domain} not supported")
+    #> Pages without any dates are counted as parse errors in metrics
+    metrics.observe(
+        'parse', publisher_domain, time.perf_counter() - parse_start, time.thread_time() - parse_cpu_start,
+        error=all([v is None for v in dates.values()]))
     return dates
\ No newline at end of file
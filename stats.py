@@ -0,0 +1,480 @@
+"""
+Summary statistics of review intervals, which are materialized in JournalStats
+by the updater and rendered by the app
+"""
+import datetime, time, threading
+from collections import OrderedDict
+
+import numpy as np
+
+from models import Article, Journal, JournalStats, DatabaseVersion
+
+EVENTS = ['received', 'accepted', 'published']
+INTERVALS = {
+    'Submit to Accept': ('received', 'accepted'),
+    'Accept to Publish': ('accepted', 'published'),
+    'Submit to Publish': ('received', 'published'),
+}
+HISTOGRAM_BIN_SIZE = 10 # days
+LOADER_BATCH_SIZE = 5000 # articles per cursor batch when loading review dates
+DATABASE_VERSION_NAME = 'articles' # id of the DatabaseVersion document
+DATABASE_VERSION_CHECK_INTERVAL = 60 # seconds between reads of the database version in each process
+
+#> Last read database version and versions of the journals, and when they were read (time.monotonic)
+database_version = {'version': 0, 'journals': {}, 'checked_time': None}
+
+def get_review_dates(journal, batch_size=LOADER_BATCH_SIZE):
+    """
+    Gets the review dates of all articles of a journal. The dates are read
+    from raw pymongo cursor batches (without creating Article documents) 
+    directly into preallocated numpy arrays
+
+    Parameters
+    ----------
+    journal: (Journal)
+    batch_size: (int) number of articles per cursor batch
+
+    Returns
+    ----------
+    review_dates: (dict) event -> numpy datetime64[D] array (NaT for missing dates)
+    """
+    articles = Article.objects.filter(journal=journal)
+    n_articles = articles.count()
+    review_dates = {event: np.full(n_articles, np.datetime64('NaT'), dtype='datetime64[ms]') for event in EVENTS}
+    n_loaded = 0
+    for article in articles.only(*EVENTS).as_pymongo().batch_size(batch_size):
+        if n_loaded == n_articles:
+            break # ignore articles added after counting
+        for event in EVENTS:
+            date = article.get(event)
+            if date is not None:
+                review_dates[event][n_loaded] = date
+        n_loaded += 1
+    return {event: dates[:n_loaded].astype('datetime64[D]') for event, dates in review_dates.items()}
+
+def get_missing_events(review_dates):
+    """
+    Returns the events which are not reported for any of the articles
+    """
+    return [event for event in EVENTS if np.isnat(review_dates[event]).all()]
+
+def filter_review_dates(review_dates, start_date=None, end_date=None):
+    """
+    Limits the review dates to the articles published between start_date and end_date,
+    and drops the articles with any missing dates
+
+    Parameters
+    ----------
+    review_dates: (dict) output of get_review_dates
+    start_date: (str or None) e.g. '2020-01-01'
+    end_date: (str or None)
+
+    Returns
+    ----------
+    review_dates: (dict) filtered review dates
+    """
+    mask = np.ones(review_dates['published'].shape[0], dtype=bool)
+    for event in EVENTS:
+        mask &= ~np.isnat(review_dates[event])
+    if start_date:
+        mask &= review_dates['published'] >= np.datetime64(start_date[:10], 'D')
+    if end_date:
+        mask &= review_dates['published'] <= np.datetime64(end_date[:10], 'D')
+    return {event: review_dates[event][mask] for event in EVENTS}
+
+def to_datetimes(dates):
+    """
+    Converts a numpy datetime64 array to a list of datetime.datetime
+    """
+    return dates.astype('datetime64[us]').tolist()
+
+def get_box_stats(values):
+    """
+    Calculates quartiles and whisker ends (furthest values within 1.5 IQR) of values
+    """
+    q1, median, q3 = np.percentile(values, [25, 50, 75])
+    iqr = q3 - q1
+    return {
+        'q1': float(q1),
+        'median': float(median),
+        'q3': float(q3),
+        'lowerfence': float(values[values >= q1 - 1.5 * iqr].min()),
+        'upperfence': float(values[values <= q3 + 1.5 * iqr].max()),
+    }
+
+def get_histogram(values, bin_size=HISTOGRAM_BIN_SIZE):
+    """
+    Counts the values in bins of bin_size days
+
+    Returns
+    ----------
+    histogram: (dict) with 'bins' (left edges) and 'counts'
+    """
+    first_edge = (values.min() // bin_size) * bin_size
+    last_edge = (values.max() // bin_size + 1) * bin_size
+    edges = np.arange(first_edge, last_edge + 1, bin_size)
+    counts, _ = np.histogram(values, bins=edges)
+    return {'bins': edges[:-1].tolist(), 'counts': counts.tolist()}
+
+def summarize_review_intervals(review_dates):
+    """
+    Summarizes the review intervals of the articles
+
+    Parameters
+    ----------
+    review_dates: (dict) output of filter_review_dates (without missing dates)
+
+    Returns
+    ----------
+    summary: (dict or None) None if there are no articles, otherwise with
+        - n_articles: (int)
+        - first_published, last_published: (datetime.datetime)
+        - intervals: (dict) interval -> median, q1 and q3 (days)
+        - histograms: (dict) interval -> output of get_histogram
+        - monthly: (dict) interval -> months (datetime.datetime) and their box stats (lists)
+    """
+    published = review_dates['published']
+    if published.shape[0] == 0:
+        return None
+    summary = {
+        'n_articles': int(published.shape[0]),
+        'first_published': to_datetimes(published.min()),
+        'last_published': to_datetimes(published.max()),
+        'intervals': {},
+        'histograms': {},
+        'monthly': {},
+    }
+    #> Group the articles by month of publication
+    published_months = published.astype('datetime64[M]')
+    order = np.argsort(published_months, kind='stable')
+    months, month_starts = np.unique(published_months[order], return_index=True)
+    for interval, (from_event, to_event) in INTERVALS.items():
+        values = (review_dates[to_event] - review_dates[from_event]).astype(int)
+        box_stats = get_box_stats(values)
+        summary['intervals'][interval] = {stat: box_stats[stat] for stat in ['median', 'q1', 'q3']}
+        summary['histograms'][interval] = get_histogram(values)
+        monthly = {'months': to_datetimes(months)}
+        for month_values in np.split(values[order], month_starts[1:]):
+            for stat, value in get_box_stats(month_values).items():
+                monthly.setdefault(stat, []).append(value)
+        summary['monthly'][interval] = monthly
+    return summary
+
+def get_interval_field(interval):
+    """
+    Converts interval name to the field name used in aggregation, e.g. 'Submit to Accept' -> 'submit_to_accept'
+    """
+    return interval.lower().replace(' ', '_')
+
+def aggregate_review_intervals(journal, start_date=None, end_date=None, bin_size=HISTOGRAM_BIN_SIZE):
+    """
+    Summarizes the review intervals of a journal's articles inside a MongoDB
+    aggregation pipeline (requires MongoDB >= 7.0 for $percentile), so that only
+    the summary is transferred from the database. The percentiles are calculated
+    by MongoDB's approximate method and may slightly differ from summarize_review_intervals.
+    Experimental: it is only tested on a real MongoDB server when REVIEW_SPEED_TEST_MONGODB
+    is set (see tests/test_aggregation.py)
+
+    Parameters
+    ----------
+    journal: (Journal)
+    start_date: (str or None) e.g. '2020-01-01'
+    end_date: (str or None)
+    bin_size: (int) histogram bin size in days
+
+    Returns
+    ----------
+    summary: (dict or None) same format as summarize_review_intervals
+    event_counts: (dict) number of articles with each event reported, and 'total' number of articles
+    """
+    is_date = lambda field: {'$eq': [{'$type': f'${field}'}, 'date']}
+    complete_conditions = [is_date(event) for event in EVENTS]
+    if start_date:
+        complete_conditions.append({'$gte': ['$published', datetime.datetime.fromisoformat(start_date[:10])]})
+    if end_date:
+        complete_conditions.append({'$lte': ['$published', datetime.datetime.fromisoformat(end_date[:10])]})
+    interval_fields = [get_interval_field(interval) for interval in INTERVALS]
+    percentiles = lambda field: {'$percentile': {'input': f'${field}', 'p': [0.25, 0.5, 0.75], 'method': 'approximate'}}
+    facets = {
+        'event_counts': [
+            {'$group': {
+                '_id': None, 
+                'total': {'$sum': 1}, 
+                **{event: {'$sum': {'$cond': [is_date(event), 1, 0]}} for event in EVENTS}}},
+        ],
+        'overall': [
+            {'$match': {'complete': True}},
+            {'$group': {
+                '_id': None,
+                'n_articles': {'$sum': 1},
+                'first_published': {'$min': '$published'},
+                'last_published': {'$max': '$published'},
+                **{field: percentiles(field) for field in interval_fields}}},
+        ],
+    }
+    for field in interval_fields:
+        facets[f'histogram_{field}'] = [
+            {'$match': {'complete': True}},
+            {'$group': {'_id': {'$multiply': [{'$floor': {'$divide': [f'${field}', bin_size]}}, bin_size]}, 'count': {'$sum': 1}}},
+            {'$sort': {'_id': 1}},
+        ]
+        facets[f'monthly_{field}'] = [
+            {'$match': {'complete': True}},
+            {'$group': {'_id': '$month', 'values': {'$push': f'${field}'}, 'quartiles': percentiles(field)}},
+            {'$sort': {'_id': 1}},
+            {'$project': {
+                'values': 1,
+                'q1': {'$arrayElemAt': ['$quartiles', 0]},
+                'median': {'$arrayElemAt': ['$quartiles', 1]},
+                'q3': {'$arrayElemAt': ['$quartiles', 2]}}},
+            {'$project': {
+                'q1': 1, 'median': 1, 'q3': 1,
+                'lowerfence': {'$min': {'$filter': {'input': '$values', 'cond': {
+                    '$gte': ['$$this', {'$subtract': ['$q1', {'$multiply': [1.5, {'$subtract': ['$q3', '$q1']}]}]}]}}}},
+                'upperfence': {'$max': {'$filter': {'input': '$values', 'cond': {
+                    '$lte': ['$$this', {'$add': ['$q3', {'$multiply': [1.5, {'$subtract': ['$q3', '$q1']}]}]}]}}}}}},
+        ]
+    pipeline = [
+        {'$project': {
+            '_id': 0,
+            **{event: 1 for event in EVENTS},
+            'complete': {'$and': complete_conditions},
+            'month': {'$dateTrunc': {'date': '$published', 'unit': 'month'}},
+            **{get_interval_field(interval): {'$dateDiff': {'startDate': f'${from_event}', 'endDate': f'${to_event}', 'unit': 'day'}}
+               for interval, (from_event, to_event) in INTERVALS.items()}}},
+        {'$facet': facets},
+    ]
+    result = next(Article.objects.filter(journal=journal).aggregate(pipeline, allowDiskUse=True))
+    if result['event_counts']:
+        event_counts = result['event_counts'][0]
+        event_counts.pop('_id')
+    else:
+        event_counts = {'total': 0, **{event: 0 for event in EVENTS}}
+    if not result['overall']:
+        return None, event_counts
+    overall = result['overall'][0]
+    summary = {
+        'n_articles': overall['n_articles'],
+        'first_published': overall['first_published'],
+        'last_published': overall['last_published'],
+        'intervals': {},
+        'histograms': {},
+        'monthly': {},
+    }
+    for interval in INTERVALS:
+        field = get_interval_field(interval)
+        summary['intervals'][interval] = dict(zip(['q1', 'median', 'q3'], overall[field]))
+        #> Fill in the empty bins
+        bin_counts = {int(histogram_bin['_id']): histogram_bin['count'] for histogram_bin in result[f'histogram_{field}']}
+        bins = list(range(min(bin_counts), max(bin_counts) + 1, bin_size))
+        summary['histograms'][interval] = {'bins': bins, 'counts': [bin_counts.get(bin_left, 0) for bin_left in bins]}
+        monthly = {'months': [month['_id'] for month in result[f'monthly_{field}']]}
+        for stat in ['q1', 'median', 'q3', 'lowerfence', 'upperfence']:
+            monthly[stat] = [float(month[stat]) for month in result[f'monthly_{field}']]
+        summary['monthly'][interval] = monthly
+    return summary, event_counts
+
+def update_journal_stats(journal):
+    """
+    Calculates the statistics of all articles of the journal and stores them in JournalStats.
+    The stats are removed if the journal has no articles with complete dates
+    """
+    summary = summarize_review_intervals(filter_review_dates(get_review_dates(journal)))
+    if summary is None:
+        JournalStats.objects(journal=journal).delete()
+        return None
+    JournalStats.objects(journal=journal).update_one(
+        upsert=True,
+        set__abbr_name=journal.abbr_name,
+        set__updated_at=datetime.datetime.now(),
+        **{f'set__{field}': value for field, value in summary.items()})
+    return summary
+
+def get_journal_stats(journal_abbr):
+    """
+    Reads the materialized statistics of a journal
+
+    Returns
+    ----------
+    journal_id: (ObjectId or None) None if not materialized
+    summary: (dict or None) same format as summarize_review_intervals, None if not materialized
+    """
+    journal_stats = JournalStats.objects(abbr_name=journal_abbr).exclude('updated_at').as_pymongo().first()
+    if journal_stats is None:
+        return None, None
+    journal_stats.pop('_id', None)
+    journal_stats.pop('abbr_name', None)
+    return journal_stats.pop('journal', None), journal_stats
+
+def update_all_journal_stats():
+    """
+    Materializes the statistics of all journals with articles, e.g. after deployment
+    """
+    journal_ids = []
+    for journal in Article.objects.distinct('journal'):
+        update_journal_stats(journal)
+        journal_ids.append(journal.id)
+    mark_database_updated(journal_ids)
+
+def mark_database_updated(journal_ids):
+    """
+    Increments the version of the journals whose articles or statistics changed, 
+    and the database version, stored in DatabaseVersion which is shared by the 
+    updater and the app processes on any host
+
+    Parameters
+    ----------
+    journal_ids: (iterable of ObjectId)
+    """
+    db_version = DatabaseVersion.objects(name=DATABASE_VERSION_NAME).modify(
+        upsert=True, new=True,
+        inc__version=1,
+        set__updated_at=datetime.datetime.now(),
+        **{f'inc__journals__{journal_id}': 1 for journal_id in journal_ids})
+    database_version.update(version=db_version.version, journals=db_version.journals, checked_time=time.monotonic())
+
+def get_database_version(journal_id=None, check_interval=DATABASE_VERSION_CHECK_INTERVAL):
+    """
+    Gets the version of the database or of a journal, which are read from the
+    database at most every check_interval seconds in each process so that the 
+    cached data of the app can be validated without querying the database on 
+    every request
+
+    Parameters
+    ----------
+    journal_id: (ObjectId or None) None gets the database version, which changes with any journal
+    check_interval: (float) 0 reads the versions from the database
+
+    Returns
+    ----------
+    version: (int) 0 if never marked as updated
+    """
+    checked_time = database_version['checked_time']
+    if (checked_time is None) or (time.monotonic() - checked_time >= check_interval):
+        db_version = DatabaseVersion.objects(name=DATABASE_VERSION_NAME).only('version', 'journals').as_pymongo().first() or {}
+        database_version.update(
+            version=db_version.get('version', 0), 
+            journals=db_version.get('journals', {}),
+            checked_time=time.monotonic())
+    if journal_id is None:
+        return database_version['version']
+    return database_version['journals'].get(str(journal_id), 0)
+
+def is_fresh(journal_id, version, loaded_time, max_age=None):
+    """
+    Checks if data of a journal cached in memory was loaded from its current 
+    version (or the current database version if journal_id is None) and, if 
+    max_age is set, less than max_age seconds ago (time.monotonic)
+    """
+    if version != get_database_version(journal_id):
+        return False
+    return (max_age is None) or (time.monotonic() - loaded_time < max_age)
+
+class ReviewDatesCache:
+    """
+    In-process cache of the review dates of journals (see get_review_dates),
+    which evicts the least recently used journals when the total size of 
+    their arrays exceeds max_bytes. The journals loaded from an older version 
+    (see get_database_version) or more than max_age seconds ago are reloaded
+
+    Parameters
+    ----------
+    max_bytes: (int) maximum total size of the cached arrays
+    max_age: (float or None) maximum age of the cached review dates in seconds
+    """
+    def __init__(self, max_bytes, max_age=None):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.entries = OrderedDict() # journal_abbr -> (review_dates, nbytes, journal_id, version, loaded_time)
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, journal_abbr, load=True):
+        """
+        Gets the review dates of a journal from the cache, or loads them if
+        load is True and they fit in the cache
+
+        Parameters
+        ----------
+        journal_abbr: (str)
+        load: (bool) load the review dates from the database if not cached
+
+        Returns
+        ----------
+        review_dates: (dict or None) event -> numpy datetime64[D] array, None if
+            not cached and not loaded
+        """
+        with self.lock:
+            entry = self.entries.get(journal_abbr)
+            if entry is not None:
+                if is_fresh(*entry[2:], self.max_age):
+                    self.entries.move_to_end(journal_abbr)
+                    return entry[0]
+                self._pop(journal_abbr)
+        if not load:
+            return None
+        #> Do not load the journals which are too large to be cached
+        journal = Journal.objects.get(abbr_name=journal_abbr)
+        n_articles = Article.objects.filter(journal=journal).count()
+        if n_articles * len(EVENTS) * np.dtype('datetime64[D]').itemsize > self.max_bytes:
+            return None
+        version, loaded_time = get_database_version(journal.id), time.monotonic()
+        review_dates = get_review_dates(journal)
+        nbytes = sum(dates.nbytes for dates in review_dates.values())
+        with self.lock:
+            if journal_abbr in self.entries:
+                self._pop(journal_abbr)
+            self.entries[journal_abbr] = (review_dates, nbytes, journal.id, version, loaded_time)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._pop(next(iter(self.entries)))
+        return review_dates
+
+    def _pop(self, journal_abbr):
+        nbytes = self.entries.pop(journal_abbr)[1]
+        self.nbytes -= nbytes
+
+class JournalStatsCache:
+    """
+    In-process cache of the materialized statistics of journals (see get_journal_stats),
+    which keeps the max_journals most recently used journals and reloads them
+    as ReviewDatesCache does
+
+    Parameters
+    ----------
+    max_journals: (int)
+    max_age: (float or None) maximum age of the cached statistics in seconds
+    """
+    def __init__(self, max_journals, max_age=None):
+        self.max_journals = max_journals
+        self.max_age = max_age
+        self.entries = OrderedDict() # journal_abbr -> (summary, journal_id, version, loaded_time)
+        self.lock = threading.Lock()
+
+    def get(self, journal_abbr):
+        """
+        Gets the statistics of a journal from the cache, or loads them
+
+        Returns
+        ----------
+        summary: (dict or None) see get_journal_stats
+        """
+        with self.lock:
+            entry = self.entries.get(journal_abbr)
+            if (entry is not None) and is_fresh(*entry[1:], self.max_age):
+                self.entries.move_to_end(journal_abbr)
+                return entry[0]
+        #> The journals without statistics are reloaded when any journal is updated
+        version, loaded_time = get_database_version(), time.monotonic()
+        journal_id, summary = get_journal_stats(journal_abbr)
+        if journal_id is not None:
+            version = get_database_version(journal_id)
+        with self.lock:
+            self.entries[journal_abbr] = (summary, journal_id, version, loaded_time)
+            self.entries.move_to_end(journal_abbr)
+            while len(self.entries) > self.max_journals:
+                self.entries.popitem(last=False)
+        return summary
+
+if __name__ == '__main__':
+    update_all_journal_stats()
@@ -0,0 +1,78 @@
+"""
+Shared fixtures of the tests, which use an in-memory mongomock database
+(the tests which need it are skipped if mongomock is not installed) and
+fake HTTP responses instead of the network
+"""
+import os, datetime
+
+import pytest
+
+#> Override the database before models is imported
+os.environ['REVIEW_SPEED_DB'] = 'mongomock://localhost/review_speed_test'
+
+
+class FakeHTTP:
+    """
+    Replaces the requests of E-utilities, doi.org and publisher pages with the 
+    responses of handlers, which are matched by a part of the url
+    """
+    def __init__(self):
+        self.handlers = {}
+        self.calls = []
+
+    def route(self, url_part, handler):
+        """
+        Sets the handler of the urls including url_part, which gets the 
+        parameters of the request and returns (status_code, text)
+        """
+        self.handlers[url_part] = handler
+
+    def request(self, url, params=None, data=None, **kwargs):
+        import requests
+        from replay import ReplayResponse
+        params = dict(params or data or {})
+        self.calls.append((url, params))
+        for url_part, handler in self.handlers.items():
+            if url_part in url:
+                status_code, text = handler(params)
+                return ReplayResponse(url, status_code, {'Content-Type': 'text/html'}, text.encode())
+        raise requests.exceptions.ConnectionError(f"No handler for {url}")
+
+class FakeSession:
+    """
+    Session of the publisher pages and doi.org served by FakeHTTP
+    """
+    def __init__(self, fake_http):
+        self.fake_http = fake_http
+
+    def get(self, url, **kwargs):
+        return self.fake_http.request(url, **kwargs)
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def fake_http(monkeypatch):
+    import requests
+    import rate_limit, scraper
+    fake_http = FakeHTTP()
+    monkeypatch.setattr(requests, 'get', fake_http.request)
+    monkeypatch.setattr(requests, 'post', fake_http.request)
+    monkeypatch.setattr(scraper, 'new_session', lambda publisher_domain: FakeSession(fake_http))
+    monkeypatch.setattr(scraper, 'SESSION_POOL', {})
+    monkeypatch.setattr(rate_limit, 'ENABLED', False)
+    return fake_http
+
+@pytest.fixture
+def journal():
+    """
+    An empty database with a journal of a supported publisher (springer)
+    """
+    pytest.importorskip('mongomock')
+    from models import Article, Journal, Publisher, FailedArticle, DOIResolution, JournalStats
+    for model in (Article, Journal, Publisher, FailedArticle, DOIResolution, JournalStats):
+        model.drop_collection()
+    journal = Journal(full_name='Journal of Tests', abbr_name='J Test', issns=['1234-5678'], 
+        last_checked=datetime.datetime.now() - datetime.timedelta(days=2)).save()
+    Publisher(domain='springer', url='link.springer.com', supported=True, journals=[journal]).save()
+    return journal
@@ -0,0 +1,93 @@
+"""
+Compares the server-side aggregation of the review intervals with
+summarize_review_intervals. mongomock does not implement $percentile,
+$dateDiff and $dateTrunc, so these tests run on a real MongoDB (>= 7.0)
+server, e.g.:
+    REVIEW_SPEED_TEST_MONGODB=mongodb://localhost:27017/review_speed_test python -m pytest tests/test_aggregation.py
+Its database is dropped after the tests
+"""
+import os, math, random, datetime, contextlib
+
+import numpy as np
+import pytest
+
+MONGODB_URL = os.environ.get('REVIEW_SPEED_TEST_MONGODB')
+pytestmark = pytest.mark.skipif(not MONGODB_URL, reason="REVIEW_SPEED_TEST_MONGODB is not set")
+
+import mongoengine
+from mongoengine.context_managers import switch_db
+
+import stats
+from models import Article, Journal
+
+MONGODB_ALIAS = 'review_speed_test_mongodb'
+N_ARTICLES = 500
+
+@pytest.fixture
+def mongod_journal():
+    """
+    A journal with articles published over two years on the real MongoDB
+    server, with uniformly distributed intervals (so that the whisker ends
+    are the min and max intervals) and some articles with missing dates
+    """
+    connection = mongoengine.connect(alias=MONGODB_ALIAS, host=MONGODB_URL)
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(switch_db(Article, MONGODB_ALIAS))
+        stack.enter_context(switch_db(Journal, MONGODB_ALIAS))
+        Article.drop_collection()
+        Journal.drop_collection()
+        journal = Journal(full_name='Journal of Tests', abbr_name='J Test').save()
+        random.seed(0)
+        articles = []
+        for article_idx in range(N_ARTICLES):
+            received = datetime.datetime(2020, 1, 1) + datetime.timedelta(days=random.randrange(730))
+            accepted = received + datetime.timedelta(days=random.randint(10, 200))
+            published = accepted + datetime.timedelta(days=random.randint(1, 60))
+            if article_idx % 50 == 0:
+                accepted = None
+            articles.append(Article(pmid=str(article_idx), received=received, accepted=accepted, published=published, journal=journal))
+        Article.objects.insert(articles)
+        yield journal
+    connection.drop_database(connection.get_default_database().name)
+    mongoengine.disconnect(alias=MONGODB_ALIAS)
+
+def assert_percentile(value, values, percentile):
+    """
+    Checks that an approximate percentile is within the values next to the exact one
+    """
+    values = np.sort(values)
+    rank = percentile * (values.shape[0] - 1)
+    lower = values[max(math.floor(rank) - 1, 0)]
+    upper = values[min(math.ceil(rank) + 1, values.shape[0] - 1)]
+    assert lower <= value <= upper
+
+@pytest.mark.parametrize('start_date, end_date', [
+    (None, None),
+    ('2021-01-01', None),
+    ('2020-06-01', '2021-06-30'),
+])
+def test_aggregation_matches_summary(mongod_journal, start_date, end_date):
+    review_dates = stats.get_review_dates(mongod_journal)
+    filtered_review_dates = stats.filter_review_dates(review_dates, start_date, end_date)
+    expected = stats.summarize_review_intervals(filtered_review_dates)
+    summary, event_counts = stats.aggregate_review_intervals(mongod_journal, start_date, end_date)
+    assert event_counts == {'total': N_ARTICLES, 'received': N_ARTICLES, 'accepted': N_ARTICLES - N_ARTICLES // 50, 'published': N_ARTICLES}
+    for field in ['n_articles', 'first_published', 'last_published', 'histograms']:
+        assert summary[field] == expected[field], field
+    published_months = filtered_review_dates['published'].astype('datetime64[M]')
+    for interval, (from_event, to_event) in stats.INTERVALS.items():
+        values = (filtered_review_dates[to_event] - filtered_review_dates[from_event]).astype(int)
+        monthly, expected_monthly = summary['monthly'][interval], expected['monthly'][interval]
+        assert monthly['months'] == expected_monthly['months']
+        for stat in ['lowerfence', 'upperfence']:
+            assert monthly[stat] == expected_monthly[stat], (interval, stat)
+        #> The percentiles of MongoDB are approximate
+        for stat, percentile in [('q1', 0.25), ('median', 0.5), ('q3', 0.75)]:
+            assert_percentile(summary['intervals'][interval][stat], values, percentile)
+            for month, month_value in zip(monthly['months'], monthly[stat]):
+                assert_percentile(month_value, values[published_months == np.datetime64(month, 'M')], percentile)
+
+def test_aggregation_of_journal_without_articles(mongod_journal):
+    summary, event_counts = stats.aggregate_review_intervals(mongod_journal, '2030-01-01')
+    assert summary is None
+    assert event_counts['total'] == N_ARTICLES
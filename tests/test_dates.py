@@ -0,0 +1,130 @@
+import random, datetime
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import dates
+import scraper
+
+DATESTR_PATTERNS = sorted(set(scraper.DATESTR_PATTERNS.values()) | {'dbY', 'dBY'}) # dBY and dbY of the soap functions
+
+def legacy_datestr_tuple_to_datetime(datestr_tuple, pattern):
+    """
+    Reference implementation using datetime.strptime for month names,
+    as in helpers before dates.py
+    """
+    for datestr_idx in range(3):
+        if pattern[datestr_idx] == 'B': # Month name full
+            month = datetime.datetime.strptime(datestr_tuple[datestr_idx], '%B').month
+        elif pattern[datestr_idx] == 'b': # Month name short
+            month = datetime.datetime.strptime(datestr_tuple[datestr_idx], '%b').month
+        elif pattern[datestr_idx] == 'm':
+            month = int(datestr_tuple[datestr_idx])
+        elif pattern[datestr_idx] == 'd':
+            day = int(datestr_tuple[datestr_idx])
+        elif pattern[datestr_idx] == 'Y':
+            year = int(datestr_tuple[datestr_idx])
+    return datetime.datetime(year, month, day)
+
+def legacy_pubmed_date_to_datetime(date_element):
+    """
+    Reference implementation of dates.pubmed_date_to_datetime, as in helpers before dates.py
+    """
+    year = int(date_element.find('Year').text)
+    month = int(date_element.find('Month').text)
+    day = int(date_element.find('Day').text)
+    return datetime.datetime(year, month, day)
+
+def convert(function, *args):
+    """
+    Output of the function, or None if it raised an exception (as the
+    callers in scraper and data_handling treat all exceptions as a missing date)
+    """
+    try:
+        return function(*args)
+    except Exception:
+        return None
+
+def strftime_tuple(date, pattern):
+    return tuple(date.strftime(f'%{code}') for code in pattern)
+
+@pytest.mark.parametrize('pattern', DATESTR_PATTERNS)
+def test_datestr_tuple_matches_legacy(pattern):
+    random.seed(0)
+    first_day = datetime.date(1990, 1, 1).toordinal()
+    random_dates = [datetime.date.fromordinal(first_day + random.randrange(365*40)) for _ in range(2000)]
+    #> Also every day of a leap year and the format variants of the pages
+    leap_year = [datetime.date(2020, 1, 1) + datetime.timedelta(days=day) for day in range(366)]
+    for date in random_dates + leap_year:
+        datestr_tuple = strftime_tuple(date, pattern)
+        variants = [datestr_tuple, tuple(datestr.upper() for datestr in datestr_tuple), tuple(datestr.lstrip('0') for datestr in datestr_tuple)]
+        for variant in variants:
+            expected = convert(legacy_datestr_tuple_to_datetime, variant, pattern)
+            assert expected is not None, variant
+            assert dates.datestr_tuple_to_datetime(variant, pattern) == expected, variant
+
+@pytest.mark.parametrize('datestr_tuple, pattern', [
+    (('31', 'April', '2020'), 'dBY'), # invalid day
+    (('29', 'February', '2019'), 'dBY'),
+    (('0', 'July', '2020'), 'dBY'),
+    (('2020', '13', '01'), 'Ymd'), # invalid month
+    (('2020', '00', '01'), 'Ymd'),
+    (('Foo', '13', '2020'), 'BdY'), # unknown month name
+    (('', '13', '2020'), 'BdY'),
+    (('July', '', '2020'), 'BdY'), # missing parts
+    (('July', '13', ''), 'BdY'),
+    (('July', '13'), 'BdY'),
+    (('July',), 'BdY'),
+    ((), 'BdY'),
+    (None, 'BdY'), # no regex match
+    (('July', '13th', '2020'), 'BdY'), # malformed parts
+    (('July', '13', '20a0'), 'BdY'),
+    (('2020', 'July', '13'), 'Ymd'),
+    (('13', '7', '2020'), 'dbY'),
+])
+def test_invalid_datestr_tuple_fails_as_legacy(datestr_tuple, pattern):
+    assert convert(legacy_datestr_tuple_to_datetime, datestr_tuple, pattern) is None
+    assert convert(dates.datestr_tuple_to_datetime, datestr_tuple, pattern) is None
+
+@pytest.mark.parametrize('datestr_tuple, pattern, expected', [
+    (('Sept.', '5', '2019'), 'BdY', datetime.datetime(2019, 9, 5)), # abbreviations with dots
+    (('5', 'Jan.', '2019'), 'dbY', datetime.datetime(2019, 1, 5)),
+    (('Jul', '13', '2020'), 'BdY', datetime.datetime(2020, 7, 13)), # abbreviated in a full month name pattern
+    (('13', 'July', '2020'), 'dbY', datetime.datetime(2020, 7, 13)), # full in an abbreviated month name pattern
+    ((' July ', '13', '2020'), 'BdY', datetime.datetime(2020, 7, 13)),
+    (('Marzo', '3', '2018'), 'BdY', datetime.datetime(2018, 3, 3)), # non-English (scielo)
+    (('dezembro', '24', '2017'), 'BdY', datetime.datetime(2017, 12, 24)),
+    (('1', 'févr.', '2016'), 'dbY', datetime.datetime(2016, 2, 1)),
+])
+def test_datestr_tuple_month_variants(datestr_tuple, pattern, expected):
+    """
+    Month names which strptime did not accept
+    """
+    assert dates.datestr_tuple_to_datetime(datestr_tuple, pattern) == expected
+
+def pubmed_date_element(**date_parts):
+    children = ''.join(f'<{tag}>{text}</{tag}>' for tag, text in date_parts.items())
+    return ET.fromstring(f'<PubMedPubDate PubStatus="received">{children}</PubMedPubDate>')
+
+@pytest.mark.parametrize('date_parts', [
+    {'Year': '2020', 'Month': '7', 'Day': '13'},
+    {'Year': '2020', 'Month': '07', 'Day': '03'},
+    {'Year': '2020', 'Month': '2', 'Day': '29'},
+    {'Year': '2020', 'Month': '12', 'Day': '31', 'Hour': '0', 'Minute': '0'},
+    {'Year': '2019', 'Month': '2', 'Day': '29'}, # invalid day
+    {'Year': '2020', 'Month': '13', 'Day': '1'},
+    {'Year': '2020', 'Month': '7'}, # partial dates
+    {'Year': '2020'},
+    {},
+    {'Year': '2020', 'Month': '', 'Day': '1'},
+    {'Year': '2020', 'Month': '7', 'Day': 'x'},
+])
+def test_pubmed_date_matches_legacy(date_parts):
+    date_element = pubmed_date_element(**date_parts)
+    assert convert(dates.pubmed_date_to_datetime, date_element) == convert(legacy_pubmed_date_to_datetime, date_element)
+
+def test_pubmed_date_is_memoized_by_value():
+    dates.ymd_strs_to_datetime.cache_clear()
+    for _ in range(3):
+        dates.pubmed_date_to_datetime(pubmed_date_element(Year='2020', Month='7', Day='13'))
+    assert dates.ymd_strs_to_datetime.cache_info().hits == 2
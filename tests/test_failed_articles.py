@@ -0,0 +1,84 @@
+import datetime, logging
+
+import pytest
+
+pytest.importorskip('mongomock')
+import data_handling
+from models import Article, FailedArticle, DOIResolution
+
+logger = logging.getLogger('test_logger')
+ESEARCH_NO_RESULTS = '<eSearchResult><Count>0</Count><QueryKey>1</QueryKey><WebEnv>W</WebEnv><IdList></IdList></eSearchResult>'
+
+def add_due_failed_article(journal, pmid, reason='no_dates'):
+    now = datetime.datetime.now()
+    FailedArticle(pmid=pmid, doi=f'10.1/{pmid}', journal=journal, publisher_domain='springer', reason=reason,
+        attempts=1, failed_at=now - datetime.timedelta(days=8), next_retry_at=now - datetime.timedelta(days=1)).save()
+
+def pubmed_article_xml(pmid):
+    """
+    PubmedArticle without review dates in its History
+    """
+    return f'''<PubmedArticle><MedlineCitation><PMID>{pmid}</PMID><Article><ArticleTitle>T{pmid}</ArticleTitle>
+        <AuthorList><Author><LastName>L</LastName><ForeName>F</ForeName></Author></AuthorList></Article></MedlineCitation>
+        <PubmedData><ArticleIdList><ArticleId IdType="doi">10.1/{pmid}</ArticleId></ArticleIdList></PubmedData></PubmedArticle>'''
+
+def route_pubmed(fake_http, pmids):
+    """
+    Routes the esearch (using history) of pmids and the efetch of their articles
+    """
+    def esearch(params):
+        if 'WebEnv' not in params:
+            return 200, f'<eSearchResult><Count>{len(pmids)}</Count><QueryKey>1</QueryKey><WebEnv>W</WebEnv></eSearchResult>'
+        retstart, retmax = int(params['retstart']), int(params['retmax'])
+        ids = ''.join(f'<Id>{pmid}</Id>' for pmid in pmids[retstart:retstart+retmax])
+        return 200, f'<eSearchResult><IdList>{ids}</IdList></eSearchResult>'
+    fake_http.route('esearch', esearch)
+    fake_http.route('efetch', lambda params: (200, '<PubmedArticleSet>' + ''.join(pubmed_article_xml(pmid) for pmid in params['id'].split(',')) + '</PubmedArticleSet>'))
+    for pmid in pmids:
+        DOIResolution(doi=f'10.1/{pmid}', landing_url=f'https://link.springer.com/article/10.1/{pmid}', domain='springer',
+            article_url=f'https://link.springer.com/article/10.1/{pmid}', failed=False, resolved_at=datetime.datetime.now()).save()
+
+def get_efetched_pmids(fake_http):
+    return [pmid for url, params in fake_http.calls if 'efetch' in url for pmid in params['id'].split(',')]
+
+def test_due_failed_article_not_in_pubmed(fake_http, journal):
+    add_due_failed_article(journal, '1001')
+    fake_http.route('esearch', lambda params: (200, ESEARCH_NO_RESULTS))
+    fake_http.route('efetch', lambda params: (200, '<?xml version="1.0" ?><PubmedArticleSet></PubmedArticleSet>'))
+    data_handling.fetch_journal_articles_data('J Test', incremental=True, verbosity=None, logger=logger)
+    failed_article = FailedArticle.objects.get(pmid='1001')
+    assert failed_article.reason == 'not_in_pubmed'
+    assert failed_article.attempts == 2
+    assert failed_article.next_retry_at - failed_article.failed_at == datetime.timedelta(days=data_handling.FAILED_RETRY_MAX_INTERVAL)
+    assert Article.objects.count() == 0
+    #> The article is no longer due, and is not fetched again
+    fake_http.calls.clear()
+    data_handling.fetch_journal_articles_data('J Test', incremental=True, verbosity=None, logger=logger)
+    assert get_efetched_pmids(fake_http) == []
+
+def test_pubmed_unreachable_is_not_recorded(fake_http, journal, monkeypatch):
+    monkeypatch.setattr(data_handling.time, 'sleep', lambda seconds: None)
+    add_due_failed_article(journal, '1001')
+    fake_http.route('esearch', lambda params: (200, ESEARCH_NO_RESULTS))
+    data_handling.fetch_journal_articles_data('J Test', incremental=True, verbosity=None, logger=logger)
+    failed_article = FailedArticle.objects.get(pmid='1001')
+    assert (failed_article.reason, failed_article.attempts) == ('no_dates', 1)
+
+@pytest.mark.parametrize('status_code', [403, 429, 503, None])
+def test_publisher_page_fetch_failure_is_retried_soon(fake_http, journal, status_code):
+    route_pubmed(fake_http, ['1001'])
+    if status_code is not None:
+        fake_http.route('link.springer.com', lambda params: (status_code, '<html>Too many requests</html>'))
+    #> without a route the request raises a ConnectionError
+    data_handling.fetch_journal_articles_data('J Test', verbosity=None, logger=logger)
+    failed_article = FailedArticle.objects.get(pmid='1001')
+    assert (failed_article.reason, failed_article.attempts) == ('page_fetch_failed', 0)
+    assert failed_article.next_retry_at - failed_article.failed_at == datetime.timedelta(days=1)
+
+def test_publisher_page_without_dates_is_backed_off(fake_http, journal):
+    route_pubmed(fake_http, ['1001'])
+    fake_http.route('link.springer.com', lambda params: (200, '<html>No dates</html>'))
+    data_handling.fetch_journal_articles_data('J Test', verbosity=None, logger=logger)
+    failed_article = FailedArticle.objects.get(pmid='1001')
+    assert (failed_article.reason, failed_article.attempts) == ('no_dates', 1)
+    assert failed_article.next_retry_at - failed_article.failed_at == datetime.timedelta(days=data_handling.FAILED_RETRY_INTERVAL)
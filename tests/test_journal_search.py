@@ -0,0 +1,39 @@
+from journal_search import JournalSearchIndex
+
+def make_journals(n_similar=300):
+    """
+    Journals sharing the word prefix "neurol", and the ones which should rank first
+    """
+    journals = [
+        {'abbr_name': f'J Neurol Sci {i}', 'full_name': f'Journal of the neurological sciences {i}', 'issns': [f'1{i:03d}-0000']}
+        for i in range(n_similar)
+    ]
+    journals += [
+        {'abbr_name': 'Neurology', 'full_name': 'Neurology', 'issns': ['0028-3878']},
+        {'abbr_name': 'Neurol Res', 'full_name': 'Neurological research', 'issns': ['0161-6412']},
+        {'abbr_name': 'Brain', 'full_name': 'Brain : a journal of neurology', 'issns': ['0006-8950']},
+    ]
+    return journals
+
+def test_name_prefix_matches_are_not_crowded_out_by_word_matches():
+    index = JournalSearchIndex(make_journals())
+    for query in ['n', 'ne', 'neu', 'neur', 'neuro', 'neurol', 'neurolo']:
+        abbr_names = [journal['abbr_name'] for journal in index.search(query, max_results=10)]
+        assert 'Neurology' in abbr_names[:2], query
+    assert index.search('neurol res')[0]['abbr_name'] == 'Neurol Res'
+
+def test_word_matches_are_not_exact():
+    index = JournalSearchIndex(make_journals())
+    #> "Neurology" is a word of the full name of Brain, but the exact match of Neurology
+    abbr_names = [journal['abbr_name'] for journal in index.search('neurology')]
+    assert abbr_names[0] == 'Neurology'
+    assert abbr_names.index('Brain') > abbr_names.index('Neurology')
+    #> An ISSN prefix outranks the word prefix matches
+    index = JournalSearchIndex(make_journals() + [{'abbr_name': 'Sci Rep', 'full_name': 'Scientific reports', 'issns': ['2045-2322']}])
+    assert index.search('sci')[0]['abbr_name'] == 'Sci Rep'
+
+def test_exact_issn_and_abbr():
+    index = JournalSearchIndex(make_journals())
+    assert index.search('0028-3878')[0]['abbr_name'] == 'Neurology'
+    assert index.search('j neurol sci 7')[0]['abbr_name'] == 'J Neurol Sci 7'
+    assert index.search('') == []
@@ -0,0 +1,84 @@
+import os, re
+
+import pytest
+
+from bs4 import BeautifulSoup
+
+import scraper
+
+PAGES_DIR = os.path.join(os.path.dirname(__file__), 'pages')
+
+def load_pages(publisher_domain):
+    """
+    Loads the saved pages of a publisher as (name, html)
+    """
+    domain_dir = os.path.join(PAGES_DIR, publisher_domain)
+    pages = []
+    for filename in sorted(os.listdir(domain_dir)):
+        with open(os.path.join(domain_dir, filename), 'rb') as f:
+            pages.append((filename, f.read().decode(errors='replace')))
+    return pages
+
+def legacy_regex_datestr_tuples(regex_pattern_dicts, html):
+    """
+    Date tuples of one re.match per event and pattern set with the original 
+    greedy ".*" patterns, as get_dates did before the patterns were compiled
+    """
+    if not isinstance(regex_pattern_dicts, list):
+        regex_pattern_dicts = [regex_pattern_dicts]
+    results = []
+    for regex_pattern_dict in regex_pattern_dicts:
+        match_groups = {}
+        for event, regex in regex_pattern_dict.items():
+            match = re.match(regex, html, flags=re.DOTALL) if regex else None
+            match_groups[event] = match.groups() if match else None
+        results.append(match_groups)
+    return results
+
+def compiled_regex_datestr_tuples(compiled_regex_patterns, html):
+    results = []
+    for compiled_regex_pattern_dict in compiled_regex_patterns:
+        results.append({
+            event: scraper.find_datestr_tuple(*compiled_regex_pattern, html) if compiled_regex_pattern else None
+            for event, compiled_regex_pattern in compiled_regex_pattern_dict.items()
+        })
+    return results
+
+@pytest.mark.parametrize('publisher_domain', sorted(scraper.REGEX_PATTERNS))
+def test_compiled_regex_matches_legacy_regex(publisher_domain):
+    pages = load_pages(publisher_domain)
+    assert pages, f"No saved pages of {publisher_domain}"
+    for name, html in pages:
+        expected = legacy_regex_datestr_tuples(scraper.REGEX_PATTERNS[publisher_domain], html)
+        assert compiled_regex_datestr_tuples(scraper.COMPILED_REGEX_PATTERNS[publisher_domain], html) == expected, name
+        found_received = any(match_groups['Received'] for match_groups in expected)
+        assert found_received == (not name.startswith('no_dates')), name
+
+def test_compiled_regex_finds_the_last_match():
+    html = dict(load_pages('karger'))['repeated.html']
+    received_pattern = scraper.COMPILED_REGEX_PATTERNS['karger'][0]['Received']
+    assert scraper.find_datestr_tuple(*received_pattern, html) == ('July', '7', '2019')
+
+def soap_datestr_tuples(soap_function, html, strainer=None):
+    """
+    Dates found by the soap function in the html parsed with the strainer,
+    or the name of the exception it raised (which get_dates treats as no dates)
+    """
+    soup = BeautifulSoup(html, features='html.parser', parse_only=strainer)
+    try:
+        return soap_function(soup)
+    except Exception as e:
+        return type(e).__name__
+
+@pytest.mark.parametrize('publisher_domain', sorted(
+    publisher_domain for publisher_domain, strainer in scraper.SOAP_STRAINERS.items() 
+    if strainer is not None))
+def test_strained_soup_matches_full_soup(publisher_domain):
+    pages = load_pages(publisher_domain)
+    assert pages, f"No saved pages of {publisher_domain}"
+    soap_function = scraper.SOAP_FUNCITONS[publisher_domain]
+    for name, html in pages:
+        expected = soap_datestr_tuples(soap_function, html)
+        assert soap_datestr_tuples(soap_function, html, scraper.SOAP_STRAINERS[publisher_domain]) == expected, name
+        found_dates = isinstance(expected, tuple) and all(expected)
+        assert found_dates == (not name.startswith('no_dates')), name
@@ -1,10 +1,15 @@
+import argparse
 import datetime
 import gc
-import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from models import *
 import data_handling
+import scraper
+import scheduler
+import stats
+import metrics
 
 
 logger = logging.getLogger('main_logger')
@@ -17,8 +22,57 @@ logger.addHandler(fh)
 
 
 UPDATE_INTERVAL = 4 #days
+UPDATE_WORKERS = 4 # number of journals updated concurrently
 
-def update(start_year=2023, end_year=None, domain='all', subject_term=None, skip_last_failed=False):
+def get_updater_run(parameters, resume=True):
+    """
+    Gets the last unfinished run with the same parameters to resume it,
+    or starts a new run
+
+    Parameters
+    ----------
+    parameters: (dict) arguments of update
+    resume: (bool) resume the last unfinished run if there is one
+
+    Returns
+    ----------
+    run: (UpdaterRun)
+    """
+    if resume:
+        run = UpdaterRun.objects(finished_at=None, parameters=parameters).order_by('-started_at').first()
+        if run is not None:
+            logger.info(f'Resuming the run started at {run.started_at} ({len(run.completed_journals)} journals completed)')
+            return run
+    return UpdaterRun(started_at=datetime.datetime.now(), parameters=parameters).save()
+
+def update_journal(journal, start_year=2023, end_year=None, incremental=True, run=None):
+    """
+    Fetches the articles data of a journal, marks the journal as updated if
+    articles were added, and marks the journal as completed in the run.
+    The requests are paced by the rate limiters shared by all workers (see rate_limit)
+
+    Parameters
+    ----------
+    journal: (Journal)
+    start_year, end_year, incremental, run: passed on to data_handling.fetch_journal_articles_data
+    """
+    n_added = 0
+    try:
+        n_added = data_handling.fetch_journal_articles_data(journal.abbr_name, start_year=start_year, end_year=end_year, incremental=incremental, run=run, logger=logger)
+    except RuntimeError as e:
+        logger.info(f'[{journal.abbr_name}] {e}')
+    else:
+        if run is not None:
+            run.update(add_to_set__completed_journals=journal.id, **{f'unset__pmid_cursors__{journal.id}': True})
+    if n_added:
+        #> Invalidate the journals list and database stats, and the data of the journal cached by the app
+        stats.mark_database_updated([journal.id])
+    #> Refresh the metrics file with the stages of this journal
+    metrics.write_metrics()
+    #> Clear the memory before going to the next journal
+    gc.collect()
+
+def update(start_year=2023, end_year=None, domain='all', subject_term=None, skip_last_failed=False, incremental=True, workers=UPDATE_WORKERS, resume=True):
     """
     A very long function which updates the review speed database until it
     is not needed and then goes into idle mode. This is executed outside
@@ -27,13 +81,15 @@ def update(start_year=2023, end_year=None, domain='all', subject_term=None, skip
     Parameters
     ----------
     start_year: (int) starting year for pubmed search which is passed on to the scraper
+    incremental: (bool) only search for articles added to PubMed since the journal was last checked
+    workers: (int) number of journals updated concurrently by a thread pool, 1 updates them one at a time
+    resume: (bool) resume the last unfinished run with the same parameters from its checkpoints
+        (completed journals and the pmid cursors of the journals in progress)
     """
     if not WRITING_ALLOWED:
         logger.info("Writing to db not allowed on this machine")
         return False
-    parent_type = 'publisher'
     if domain is None:
-        parent_type = 'subject_term'
         if subject_term == 'all':
             parents = BroadSubjectTerm.objects.all()
         else:
@@ -44,37 +100,40 @@ def update(start_year=2023, end_year=None, domain='all', subject_term=None, skip
         parents = Publisher.objects.filter(supported=True)
     else:
         parents = Publisher.objects.filter(domain=domain)
-    parents = list(parents) # to avoid CursorNotFound error
-    for parent in parents:
-        if parent_type == 'publisher':
-            parent_name = parent.domain
-        else:
-            parent_name = parent.name
-        #> Get all journals of the publisher
-        journals = list(parent.journals) # list to avoid CursorNotFound error
-        logger.info(f'[{parent_type}: {parent_name}] includes {len(journals)} journals')
-        counter = 0
-        for journal in journals:
-            #> Update the journal if it is scrapable (last_failed=False) and its data is > UPDATE_INTERVAL days old
-            needs_update = (datetime.datetime.now() - journal.last_checked).days > UPDATE_INTERVAL
-            if needs_update:
-                logger.info(f'[{journal.abbr_name}] ({counter} of {len(journals)}) needs update')
-                if journal.last_failed and skip_last_failed:
-                    logger.info(f'[{journal.abbr_name}] failed last time')
-                else:
-                    data_handling.fetch_journal_articles_data(journal.abbr_name, start_year=start_year, end_year=end_year, logger=logger)
-            else:
-                logger.info(f'[{journal.abbr_name}] ({counter} of {len(journals)}) skipping update (last_checked={journal.last_checked})')
-            #> Clear the memory and wait 1 sec before going to the next journal
-            gc.collect()
-            time.sleep(1)
-            counter += 1
+    run = get_updater_run(dict(
+        start_year=start_year, end_year=end_year, domain=domain, subject_term=subject_term, 
+        skip_last_failed=skip_last_failed, incremental=incremental), resume)
+    metrics.reset_metrics()
+    #> Get the unique stale journals of all parents, with the most productive first
+    journals = scheduler.schedule_journals(parents, UPDATE_INTERVAL, skip_last_failed, exclude_ids=run.completed_journals)
+    logger.info(f'{len(journals)} journals need update')
+    def update_scheduled_journal(counter, journal):
+        logger.info(f'[{journal.abbr_name}] ({counter} of {len(journals)}) updating (last_checked={journal.last_checked})')
+        update_journal(journal, start_year, end_year, incremental, run)
+    #> Update the journals (concurrently if workers > 1)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(update_scheduled_journal, range(len(journals)), journals))
+    else:
+        for counter, journal in enumerate(journals):
+            update_scheduled_journal(counter, journal)
+    run.update(set__finished_at=datetime.datetime.now())
+    metrics.write_metrics()
+    #> Close the publisher sessions shared by all journals of this run
+    scraper.close_sessions()
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Updates the review speed database')
+    resume_group = parser.add_mutually_exclusive_group()
+    resume_group.add_argument('--resume', dest='resume', action='store_true', default=True,
+        help='resume the last unfinished run from its checkpoints (default)')
+    resume_group.add_argument('--fresh', dest='resume', action='store_false',
+        help='start a new run from the first parent')
+    args = parser.parse_args()
     # for subject_term in [
     #     'Behavioral Sciences', 'Brain', 'Diagnostic Imaging', 
     #     'Neurology', 'Neurosurgery', 'Psychiatry', 'Psychology',
     #     'Psychopathology', 'Psychopharmacology', 'Psychophysiology',
     #     'Radiology', 'Science'
     #     ]:
-    update(start_year=2023, end_year=2023, domain=None, subject_term='all', skip_last_failed=True)
\ No newline at end of file
+    update(start_year=2023, end_year=2023, domain=None, subject_term='all', skip_last_failed=True, resume=args.resume)
\ No newline at end of file